@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Set
+
+from llm_cache import BatchPending
+from openai_batch import collect_results, enable_offline_mode, submit_pending, wait_for_batches
+from workflow_driver import file_digest, process_cv
+
+# Documents in flight at once. Every document shares the process-wide OpenAI and S2 rate
+# limiters, so this only needs to be high enough to keep those quotas busy.
+BATCH_MAX_DOCUMENTS = int(os.environ.get("BATCH_MAX_DOCUMENTS", 8))
+
+def list_pdfs(source: str) -> List[str]:
+    """
+    PDF paths from a directory (searched recursively) or a manifest file with one path
+    per line; relative manifest entries are resolved against the manifest's directory.
+    """
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(source)
+            for name in names if name.lower().endswith(".pdf")
+        )
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, "r") as file:
+        entries = [line.strip() for line in file]
+    return [
+        entry if os.path.isabs(entry) else os.path.join(base, entry)
+        for entry in entries if entry and not entry.startswith("#")
+    ]
+
+def completed_documents(output_path: str) -> Set[str]:
+    """Digests of documents that already have a successful result in the output file."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run
+                continue
+            if record.get("status") == "ok":
+                done.add(record["sha256"])
+    return done
+
+def evaluate_document(pdf_path: str, digest: str) -> Dict:
+    started = time.monotonic()
+    record = {"pdf_path": pdf_path, "sha256": digest}
+    try:
+        record.update(status="ok", output=process_cv(pdf_path))
+    except BatchPending:
+        # Offline mode: the document resumes from its checkpoints once the batch returns
+        record["status"] = "pending"
+    except Exception as e:
+        traceback.print_exc()
+        record.update(status="error", error=str(e))
+    record["seconds"] = round(time.monotonic() - started, 2)
+    return record
+
+def run_batch(pdf_paths: Iterable[str], output_path: str, max_documents: int = BATCH_MAX_DOCUMENTS) -> Dict[str, int]:
+    """
+    Evaluate many CVs concurrently and append one JSON line per document to
+    `output_path` as soon as it finishes. Documents whose content already has a
+    successful line in the file are skipped, so an interrupted run can be restarted
+    with the same arguments.
+    """
+    done = completed_documents(output_path)
+    pending = []
+    seen = set()
+    for pdf_path in pdf_paths:
+        digest = file_digest(pdf_path)
+        if digest in done or digest in seen:
+            continue
+        seen.add(digest)
+        pending.append((pdf_path, digest))
+    counts = {"skipped": len(done), "ok": 0, "error": 0, "pending": 0}
+    print(f"Evaluating {len(pending)} documents ({len(done)} already completed)")
+
+    with open(output_path, "a") as output, ThreadPoolExecutor(max_workers=max(1, max_documents)) as executor:
+        futures = [executor.submit(evaluate_document, pdf_path, digest) for pdf_path, digest in pending]
+        for index, future in enumerate(as_completed(futures), start=1):
+            record = future.result()
+            counts[record["status"]] += 1
+            if record["status"] == "pending":
+                continue
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            print(f"[{index}/{len(pending)}] {record['status']} {record['pdf_path']} in {record['seconds']}s")
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate a directory or manifest of CVs for O-1A categories.")
+    parser.add_argument("source", help="directory of PDFs, or a manifest file listing one PDF path per line")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSON Lines file results are appended to")
+    parser.add_argument("-j", "--max-documents", type=int, default=BATCH_MAX_DOCUMENTS, help="documents evaluated at once")
+    parser.add_argument("--offline", action="store_true", help="send LLM requests through the OpenAI Batch API (slower, about half the cost)")
+    parser.add_argument("--no-wait", action="store_true", help="with --offline, submit the queued requests and exit; rerun later to resume")
+    args = parser.parse_args()
+
+    pdf_paths = list_pdfs(args.source)
+    if not args.offline:
+        counts = run_batch(pdf_paths, args.output, args.max_documents)
+        print(f"Done: {counts['ok']} succeeded, {counts['error']} failed, {counts['skipped']} skipped")
+        return
+
+    # Each round runs every unfinished document as far as the cached LLM responses allow,
+    # then submits the requests they are waiting for as one set of batches
+    enable_offline_mode()
+    # Pick up batches submitted by an earlier --no-wait run
+    collect_results()
+    while True:
+        counts = run_batch(pdf_paths, args.output, args.max_documents)
+        print(f"Round: {counts['ok']} succeeded, {counts['error']} failed, {counts['pending']} waiting on the Batch API")
+        if not counts["pending"]:
+            break
+        submit_pending()
+        if args.no_wait:
+            print("Requests submitted; rerun the same command to collect results and continue.")
+            break
+        if not wait_for_batches():
+            print("No batch responses were returned; stopping.")
+            break
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import json
+import time
+from typing import Any, Dict, List
+
+from evaluator import CATEGORIES, CategoryRating, O1AEvaluation, evaluate_categories, load_json_data
+
+MODES = ["per_category", "combined"]
+RATING_SCALE = {"low": 0, "medium": 1, "high": 2}
+
+def run_mode(mode: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    # Bypass the LLM cache so every run measures a real round trip
+    usage: Dict[str, int] = {}
+    started = time.monotonic()
+    evaluations = evaluate_categories(CATEGORIES, data, mode=mode, use_cache=False, usage=usage)
+    seconds = time.monotonic() - started
+    # Both modes must produce a valid O1AEvaluation
+    O1AEvaluation(
+        name=data["name"],
+        email=data["email"],
+        education=data["education"],
+        category_ratings=[CategoryRating(category=category, **evaluation) for category, evaluation in zip(CATEGORIES, evaluations)]
+    )
+    return {
+        "seconds": seconds,
+        "usage": usage,
+        "ratings": {category: evaluation["rating"] for category, evaluation in zip(CATEGORIES, evaluations)},
+    }
+
+def agreement(a: Dict[str, str], b: Dict[str, str]) -> Dict[str, float]:
+    exact = sum(a[category] == b[category] for category in CATEGORIES)
+    distance = sum(abs(RATING_SCALE.get(a[category], 0) - RATING_SCALE.get(b[category], 0)) for category in CATEGORIES)
+    return {"exact": exact / len(CATEGORIES), "mean_rating_distance": distance / len(CATEGORIES)}
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, float]:
+    count = len(runs)
+    return {
+        "mean_seconds": sum(run["seconds"] for run in runs) / count,
+        "mean_requests": sum(run["usage"].get("requests", 0) for run in runs) / count,
+        "mean_prompt_tokens": sum(run["usage"].get("prompt_tokens", 0) for run in runs) / count,
+        "mean_completion_tokens": sum(run["usage"].get("completion_tokens", 0) for run in runs) / count,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the per-category and combined evaluator modes.")
+    parser.add_argument("data", nargs="?", default="further_enriched_cv_data.json", help="analysed CV JSON (output of cv_analyst)")
+    parser.add_argument("-n", "--runs", type=int, default=3, help="runs per mode")
+    args = parser.parse_args()
+
+    data = load_json_data(args.data)
+    results = {mode: [run_mode(mode, data) for _ in range(args.runs)] for mode in MODES}
+
+    report = {mode: summarize(runs) for mode, runs in results.items()}
+    # Cross-mode agreement pairs the i-th run of each mode; within-mode agreement shows
+    # how much of the disagreement is ordinary run-to-run variation
+    report["agreement"] = {
+        "per_category_vs_combined": [agreement(a["ratings"], b["ratings"]) for a, b in zip(results["per_category"], results["combined"])],
+        **{
+            f"{mode}_run_to_run": [agreement(a["ratings"], b["ratings"]) for a, b in zip(runs, runs[1:])]
+            for mode, runs in results.items()
+        },
+    }
+    report["ratings"] = {mode: [run["ratings"] for run in runs] for mode, runs in results.items()}
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Returned by get() when a key is absent, so that cached None values can be told apart
+MISSING = object()
+
+# Eviction runs every EVICT_INTERVAL writes rather than on each one
+EVICT_INTERVAL = 100
+
+def make_key(*parts: Any) -> str:
+    """Stable content hash of JSON-serialisable key parts."""
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class MemoryLRUCache:
+    """In-process counterpart of SQLiteCache with the same interface."""
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: Any = MISSING) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (self.ttl is not None and time.time() - entry[1] > self.ttl):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            if self.max_entries is not None:
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+class SQLiteCache:
+    """
+    Persistent key/value cache stored in a single SQLite file.
+
+    Values are JSON-encoded. Entries older than `ttl` seconds are treated as misses,
+    and once the store holds more than `max_entries` rows the least recently used
+    ones are evicted. Hit/miss counters are kept per instance.
+    """
+
+    def __init__(self, path: str, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        # Row count as of the last write; None until this instance first writes
+        self._count: Optional[int] = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def get(self, key: str, default: Any = MISSING) -> Any:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                if row is not None:
+                    self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.misses += 1
+                return default
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any):
+        now = time.time()
+        encoded = json.dumps(value)
+        with self._lock, self._conn:
+            if self._count is None:
+                # Other processes may have filled the file, so count on the first write
+                self._count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            exists = self._conn.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, encoded, now, now)
+            )
+            if not exists:
+                self._count += 1
+            self._writes += 1
+            # Evict as soon as the store is over its size bound, and sweep expired rows
+            # every EVICT_INTERVAL writes
+            if (self.max_entries is not None and self._count > self.max_entries) or self._writes % EVICT_INTERVAL == 0:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+        if self.max_entries is not None:
+            self._conn.execute(
+                "DELETE FROM entries WHERE key IN "
+                "(SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        # Recount, which also picks up rows written by other processes since
+        self._count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def delete(self, key: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._count = None
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries")
+            self._count = None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
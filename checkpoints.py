@@ -0,0 +1,53 @@
+import os
+import threading
+from typing import Any, Callable, Optional
+
+from cache import MISSING, SQLiteCache, make_key
+
+# Stage outputs of process_cv, keyed by stage, stage version and a hash of the stage's
+# inputs; set CHECKPOINT_PATH to an empty string to disable checkpointing
+CHECKPOINT_PATH = os.environ.get("CHECKPOINT_PATH", os.path.join(".cache", "checkpoints.sqlite"))
+CHECKPOINT_TTL = float(os.environ.get("CHECKPOINT_TTL", 7 * 24 * 3600))
+CHECKPOINT_MAX_ENTRIES = int(os.environ.get("CHECKPOINT_MAX_ENTRIES", 20000))
+
+class CheckpointStore:
+    """
+    Stores the output of each pipeline stage under a key derived from its inputs, so a
+    rerun over the same inputs picks up every stage that already completed. Changing a
+    stage's version invalidates that stage only; stages downstream of it rerun because
+    their inputs change.
+    """
+
+    def __init__(self, cache: Optional[SQLiteCache]):
+        self.cache = cache
+
+    def key(self, stage: str, version: Any, inputs: Any) -> str:
+        return make_key("checkpoint", stage, version, inputs)
+
+    def get(self, key: str) -> Any:
+        return self.cache.get(key) if self.cache is not None else MISSING
+
+    def set(self, key: str, value: Any):
+        if self.cache is not None:
+            self.cache.set(key, value)
+
+    def run(self, stage: str, version: Any, inputs: Any, compute: Callable[[], Any]) -> Any:
+        key = self.key(stage, version, inputs)
+        value = self.get(key)
+        if value is not MISSING:
+            print(f"Resumed {stage} from checkpoint")
+            return value
+        value = compute()
+        self.set(key, value)
+        return value
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_checkpoint_store() -> CheckpointStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            cache = SQLiteCache(CHECKPOINT_PATH, ttl=CHECKPOINT_TTL, max_entries=CHECKPOINT_MAX_ENTRIES) if CHECKPOINT_PATH else None
+            _store = CheckpointStore(cache)
+        return _store
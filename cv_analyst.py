@@ -1,15 +1,37 @@
 import os
 import json
-from typing import List, Dict, Any
+import time
+import threading
+from statistics import median
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Any, Callable, Iterable, Optional, Tuple
 from openai import OpenAI
+from llm_cache import create_chat_completion
+from incremental import split_changed_records
+from publication_scoring import PUBLICATION_RULES, rule_labels
+import field_baselines
 
 # Initialize OpenAI client
 client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
+# Concurrency limit and per-call timeout (seconds) for the analyze_cv labelling stage
+ANALYSIS_MAX_WORKERS = int(os.environ.get("ANALYSIS_MAX_WORKERS", 5))
+ANALYSIS_TIMEOUT = float(os.environ.get("ANALYSIS_TIMEOUT", 300))
+
+# Publications per labelling request when enrichment and labelling are pipelined, and
+# labelling requests allowed in flight before the producer is held back
+PUBLICATION_LABEL_BATCH_SIZE = int(os.environ.get("PUBLICATION_LABEL_BATCH_SIZE", 25))
+PUBLICATION_LABEL_MAX_IN_FLIGHT = int(os.environ.get("PUBLICATION_LABEL_MAX_IN_FLIGHT", 4))
+
+# Bounds for each research-field classification request
+CLASSIFICATION_CHUNK_SIZE = int(os.environ.get("CLASSIFICATION_CHUNK_SIZE", 50))
+CLASSIFICATION_CHUNK_CHARS = int(os.environ.get("CLASSIFICATION_CHUNK_CHARS", 8000))
+
 def analyze_education(education: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     prompt = f"Analyze the following education data and label each record as 'extraordinary' if it's from a prestigious institution or involves a notable degree. Education data: {json.dumps(education)}"
     
-    response = client.chat.completions.create(
+    response = create_chat_completion(
+        client,
         model="gpt-4o",
         messages=[
             {"role": "system", "content": "You are an expert in evaluating academic credentials."},
@@ -49,7 +71,8 @@ def analyze_education(education: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
 def analyze_awards(awards: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     prompt = f"Analyze the following awards data and label each record as 'extraordinary' if it's a high-stakes or prestigious award. Awards data: {json.dumps(awards)}"
     
-    response = client.chat.completions.create(
+    response = create_chat_completion(
+        client,
         model="gpt-4o",
         messages=[
             {"role": "system", "content": "You are an expert in evaluating academic and scientific awards."},
@@ -85,10 +108,28 @@ def analyze_awards(awards: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     
     return json.loads(response.choices[0].message.tool_calls[0].function.arguments)["labeled_awards"]
 
-def analyze_publications(publications: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def analyze_publications(publications: List[Dict[str, Any]], fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Label publications as extraordinary. Papers whose citation percentile or venue tier
+    settles the question are labelled by the rules in publication_scoring; only the
+    ambiguous ones are sent to the LLM.
+    """
+    labels = rule_labels(publications, fields) if PUBLICATION_RULES else [None] * len(publications)
+    ambiguous = [pub for pub, label in zip(publications, labels) if label is None]
+    print(f"Labelled {len(publications) - len(ambiguous)} publications by rule, sending {len(ambiguous)} to the LLM")
+    llm_labels = iter(_match_labels(ambiguous, label_publications_with_llm(ambiguous)) if ambiguous else [])
+    return [
+        next(llm_labels) if label is None else
+        {"title": pub.get('title'), "venue": pub.get('venue'), "year": pub.get('year'),
+         "citation_count": pub.get('citation_count'), "extraordinary": label}
+        for pub, label in zip(publications, labels)
+    ]
+
+def label_publications_with_llm(publications: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     prompt = f"Analyze the following publications data and label each record as 'extraordinary' if it has a high citation count or is published in an important journal or conference. Publications data: {json.dumps(publications)}"
     
-    response = client.chat.completions.create(
+    response = create_chat_completion(
+        client,
         model="gpt-4o",
         messages=[
             {"role": "system", "content": "You are an expert in evaluating academic publications."},
@@ -129,7 +170,8 @@ def analyze_publications(publications: List[Dict[str, Any]]) -> List[Dict[str, A
 def analyze_employment(employment: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     prompt = f"Analyze the following employment data and label each record as 'extraordinary' if it's a high-stakes or prestigious position. Employment data: {json.dumps(employment)}"
     
-    response = client.chat.completions.create(
+    response = create_chat_completion(
+        client,
         model="gpt-4o",
         messages=[
             {"role": "system", "content": "You are an expert in evaluating academic and research positions."},
@@ -168,114 +210,172 @@ def analyze_employment(employment: List[Dict[str, Any]]) -> List[Dict[str, Any]]
     
     return json.loads(response.choices[0].message.tool_calls[0].function.arguments)["labeled_employment"]
 
-def analyze_research_fields(cv_data: Dict[str, Any]) -> List[Dict[str, Any]]:
-    publications = cv_data['publications']
-    predicted_fields = cv_data['predicted_research_fields']
+def _match_labels(batch: List[Dict[str, Any]], labelled: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Labels normally come back one per input in order; otherwise match them by title
+    if len(labelled) == len(batch):
+        return labelled
+    by_title = {(record.get('title') or '').strip().lower(): record for record in labelled}
+    return [
+        by_title.get((pub.get('title') or '').strip().lower())
+        or {"title": pub.get('title'), "venue": pub.get('venue'), "year": pub.get('year'),
+            "citation_count": pub.get('citation_count'), "extraordinary": ""}
+        for pub in batch
+    ]
+
+def label_publication_stream(stream: Iterable[Tuple[int, Dict[str, Any]]], count: int, batch_size: Optional[int] = None,
+                             max_in_flight: Optional[int] = None, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Label (index, publication) pairs as they arrive. Batch k always holds indices
+    [k * batch_size, (k + 1) * batch_size) in index order and is dispatched as soon as
+    all of them have arrived, so each request (and its LLM cache key) is the same on
+    every run whatever order the lookups finish in. At most `max_in_flight` requests run
+    at once; reading from `stream` pauses until one finishes. Returns the labelled
+    publications in index order.
+    """
+    batch_size = batch_size or PUBLICATION_LABEL_BATCH_SIZE
+    max_in_flight = max(1, max_in_flight or PUBLICATION_LABEL_MAX_IN_FLIGHT)
+    slots = threading.BoundedSemaphore(max_in_flight)
+    labelled: List[Optional[Dict[str, Any]]] = [None] * count
     
-    # Create a dictionary to store publications for each field
-    field_publications = {field: [] for field in predicted_fields}
+    def label(indices, batch):
+        try:
+            for i, record in zip(indices, analyze_publications(batch, fields)):
+                labelled[i] = record
+        finally:
+            slots.release()
     
-    # Classify each publication into fields
-    for pub in publications:
-        prompt = f"Classify the following publication into one or more of these research fields: {', '.join(predicted_fields)}. Publication title: {pub['title']}"
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are an expert in classifying academic publications into research fields."},
-                {"role": "user", "content": prompt}
-            ],
-            tools=[{
-                "type": "function",
-                "function": {
-                    "name": "classify_publication",
-                    "description": "Classify a publication into research fields",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "fields": {
-                                "type": "array",
-                                "items": {"type": "string"},
-                                "description": "List of research fields this publication belongs to"
-                            }
-                        },
-                        "required": ["fields"]
-                    }
-                }
-            }],
-            tool_choice={"type": "function", "function": {"name": "classify_publication"}}
-        )
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = []
+        # Publications that arrived before the rest of their batch
+        arrived: Dict[int, Dict[str, Any]] = {}
         
-        fields = json.loads(response.choices[0].message.tool_calls[0].function.arguments)["fields"]
+        def dispatch(indices):
+            slots.acquire()
+            futures.append(executor.submit(label, indices, [arrived.pop(i) for i in indices]))
         
-        for field in fields:
-            if field in field_publications:
-                field_publications[field].append(pub)
-    
-    # Calculate median citation count and publication count for each field
-    field_metrics = []
-    for field, pubs in field_publications.items():
-        publication_count = len(pubs)
-        citation_counts = [pub.get('citation_count', 0) for pub in pubs]
-        median_citation_count = int(median(citation_counts)) if citation_counts else 0
-        
-        field_metrics.append({
-            "field": field,
-            "median_publication_count": publication_count,
-            "median_citation_count": median_citation_count
-        })
-    
-    return field_metrics
-
-def estimate_field_statistics(fields: List[str]) -> List[Dict[str, Any]]:
-    prompt = f"""
-    For each of the following research fields, estimate the median annual publication count and median career citation count for researchers in that field. Consider that:
-    1. Different fields may have varying publication rates and citation patterns.
-    2. These are rough estimates for an average researcher over their career.
-    3. Some fields may have higher publication rates but lower citation counts, or vice versa.
+        for i, pub in stream:
+            arrived[i] = pub
+            start = i // batch_size * batch_size
+            indices = list(range(start, min(start + batch_size, count)))
+            if all(j in arrived for j in indices):
+                dispatch(indices)
+        # A stream that ended early leaves incomplete batches; label what arrived of them
+        for start in sorted({i // batch_size * batch_size for i in arrived}):
+            dispatch([j for j in range(start, min(start + batch_size, count)) if j in arrived])
+        for future in futures:
+            future.result()
+    return labelled
 
-    Research fields: {json.dumps(fields)}
+def chunk_publications(publications: List[Dict[str, Any]], max_items: int, max_chars: int) -> List[List[int]]:
+    """Group publication indices into chunks bounded by item count and total title length."""
+    chunks = []
+    current = []
+    current_chars = 0
+    for i, pub in enumerate(publications):
+        title_chars = len(pub.get('title') or '')
+        if current and (len(current) >= max_items or current_chars + title_chars > max_chars):
+            chunks.append(current)
+            current = []
+            current_chars = 0
+        current.append(i)
+        current_chars += title_chars
+    if current:
+        chunks.append(current)
+    return chunks
 
-    Provide your best estimate for each field, based on general trends in academia.
-    """
+def classify_publication_chunk(publications: List[Dict[str, Any]], indices: List[int], predicted_fields: List[str]) -> Dict[int, List[str]]:
+    titles = "\n".join(f"{i}. {publications[i]['title']}" for i in indices)
+    prompt = f"Classify each of the following publications into one or more of these research fields: {', '.join(predicted_fields)}. Return one classification per publication, keyed by its index.\n\nPublications:\n{titles}"
     
-    response = client.chat.completions.create(
+    response = create_chat_completion(
+        client,
         model="gpt-4o",
         messages=[
-            {"role": "system", "content": "You are an expert in academic research trends across various fields."},
+            {"role": "system", "content": "You are an expert in classifying academic publications into research fields."},
             {"role": "user", "content": prompt}
         ],
         tools=[{
             "type": "function",
             "function": {
-                "name": "estimate_field_statistics",
-                "description": "Estimate median publication and citation counts for researchers in each field",
+                "name": "classify_publications",
+                "description": "Classify publications into research fields",
                 "parameters": {
                     "type": "object",
                     "properties": {
-                        "field_statistics": {
+                        "classifications": {
                             "type": "array",
                             "items": {
                                 "type": "object",
                                 "properties": {
-                                    "field": {"type": "string"},
-                                    "median_annual_publication_count": {"type": "number"},
-                                    "median_career_citation_count": {"type": "integer"}
+                                    "index": {"type": "integer"},
+                                    "fields": {
+                                        "type": "array",
+                                        "items": {"type": "string", "enum": predicted_fields},
+                                        "description": "List of research fields this publication belongs to"
+                                    }
                                 },
-                                "required": ["field", "median_annual_publication_count", "median_career_citation_count"]
+                                "required": ["index", "fields"]
                             }
                         }
                     },
-                    "required": ["field_statistics"]
+                    "required": ["classifications"]
                 }
             }
         }],
-        tool_choice={"type": "function", "function": {"name": "estimate_field_statistics"}}
+        tool_choice={"type": "function", "function": {"name": "classify_publications"}}
     )
     
-    return json.loads(response.choices[0].message.tool_calls[0].function.arguments)["field_statistics"]
+    classifications = json.loads(response.choices[0].message.tool_calls[0].function.arguments)["classifications"]
+    # Ignore indices the model invented outside this chunk
+    return {c["index"]: c["fields"] for c in classifications if c.get("index") in indices}
+
+def analyze_research_fields(cv_data: Dict[str, Any], max_workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    publications = cv_data['publications']
+    predicted_fields = cv_data['predicted_research_fields']
+    
+    # Create a dictionary to store publications for each field
+    field_publications = {field: [] for field in predicted_fields}
+    
+    # Classify publications in size-bounded chunks, one request per chunk
+    chunks = chunk_publications(publications, CLASSIFICATION_CHUNK_SIZE, CLASSIFICATION_CHUNK_CHARS)
+    if chunks and predicted_fields:
+        max_workers = max_workers or ANALYSIS_MAX_WORKERS
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+            chunk_results = list(executor.map(
+                lambda indices: classify_publication_chunk(publications, indices, predicted_fields),
+                chunks
+            ))
+        
+        # Walk publications in their original order so field lists are deterministic
+        classifications = {}
+        for result in chunk_results:
+            classifications.update(result)
+        for i, pub in enumerate(publications):
+            for field in classifications.get(i, []):
+                if field in field_publications:
+                    field_publications[field].append(pub)
+    
+    # Calculate median citation count and publication count for each field
+    field_metrics = []
+    for field, pubs in field_publications.items():
+        publication_count = len(pubs)
+        citation_counts = [pub.get('citation_count') or 0 for pub in pubs]
+        median_citation_count = int(median(citation_counts)) if citation_counts else 0
+        
+        field_metrics.append({
+            "field": field,
+            "median_publication_count": publication_count,
+            "median_citation_count": median_citation_count
+        })
+    
+    return field_metrics
+
+def estimate_field_statistics(fields: List[str]) -> List[Dict[str, Any]]:
+    # Looked up in the local field baseline table rather than estimated by the LLM, so
+    # the numbers are the same on every run
+    return field_baselines.field_statistics(fields)
 
-def analyze_researcher_impact(cv_data: Dict[str, Any], field_statistics: List[Dict[str, Any]]) -> Dict[str, Any]:
+def analyze_researcher_impact(cv_data: Dict[str, Any], field_statistics: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
     researcher_stats = {
         "total_publications": len(cv_data['publications']),
         "total_citations": sum(p.get('citation_count', 0) for p in cv_data['publications']),
@@ -284,15 +384,17 @@ def analyze_researcher_impact(cv_data: Dict[str, Any], field_statistics: List[Di
     
     researcher_stats["annual_publication_rate"] = researcher_stats["total_publications"] / researcher_stats["years_active"]
     
+    if field_statistics is None:
+        field_statistics = estimate_field_statistics(cv_data.get('predicted_research_fields', []))
+    by_field = {f["field"]: f for f in field_statistics}
+    
     impact_analysis = []
-    for field in field_statistics:
-        field_stats = next((f for f in field_statistics if f["field"] == field["field"]), None)
-        if field_stats:
-            impact_analysis.append({
-                "field": field["field"],
-                "publication_rate_comparison": researcher_stats["annual_publication_rate"] / field_stats["median_annual_publication_count"],
-                "citation_impact_comparison": researcher_stats["total_citations"] / field_stats["median_career_citation_count"]
-            })
+    for field, field_stats in by_field.items():
+        impact_analysis.append({
+            "field": field,
+            "publication_rate_comparison": researcher_stats["annual_publication_rate"] / field_stats["median_annual_publication_count"],
+            "citation_impact_comparison": researcher_stats["total_citations"] / field_stats["median_career_citation_count"]
+        })
     
     return {
         "researcher_statistics": researcher_stats,
@@ -311,7 +413,8 @@ def analyze_media_coverage(media_coverage: List[Dict[str, Any]], researcher_name
     Media coverage data: {json.dumps(media_coverage)}
     """
     
-    response = client.chat.completions.create(
+    response = create_chat_completion(
+        client,
         model="gpt-4o",
         messages=[
             {"role": "system", "content": "You are an expert in analyzing media coverage of scientific researchers."},
@@ -351,14 +454,134 @@ def analyze_media_coverage(media_coverage: List[Dict[str, Any]], researcher_name
     
     return json.loads(response.choices[0].message.tool_calls[0].function.arguments)["labeled_media_coverage"]
 
-def analyze_cv(cv_data: Dict[str, Any]) -> Dict[str, Any]:
+def run_concurrent_stage(tasks: Dict[str, Tuple[Callable, tuple]], max_workers: int, timeout: Optional[float] = None) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """
+    Run independent calls concurrently and return (results, durations) keyed by task name.
+    The timeout applies to each call from the moment it starts running, so calls queued
+    behind the concurrency limit are not penalised for waiting.
+    """
+    started = {}
+    durations = {}
+
+    def timed(name, func, args):
+        started[name] = time.monotonic()
+        try:
+            return func(*args)
+        finally:
+            durations[name] = time.monotonic() - started[name]
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks))))
+    futures = {executor.submit(timed, name, func, args): name for name, (func, args) in tasks.items()}
+    pending = set(futures)
+    try:
+        while pending:
+            wait_for = None
+            if timeout is not None:
+                now = time.monotonic()
+                for future in pending:
+                    name = futures[future]
+                    if name in started and now - started[name] > timeout:
+                        raise TimeoutError(f"{name} did not finish within {timeout}s")
+                # Wake up when the earliest running call would hit its deadline
+                deadlines = [started[futures[f]] + timeout - now for f in pending if futures[f] in started]
+                wait_for = max(0.0, min(deadlines)) + 0.01 if deadlines else 0.1
+            _, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+        # Surface any exception only once every call has had the chance to finish
+        results = {futures[future]: future.result() for future in futures}
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results, durations
+
+def analyze_cv(cv_data: Dict[str, Any], max_workers: Optional[int] = None, timeout: Optional[float] = None, timings: Optional[Dict[str, float]] = None,
+               labelled: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    # Each section is labelled by an independent LLM call, so dispatch them together.
+    # Sections in `labelled` were already labelled upstream and are used as they are.
+    labelled = labelled or {}
+    tasks = {
+        'education': (analyze_education, (cv_data['education'],)),
+        'awards': (analyze_awards, (cv_data['awards'],)),
+        'publications': (analyze_publications, (cv_data['publications'], cv_data.get('predicted_research_fields'))),
+        'employment_history': (analyze_employment, (cv_data['employment_history'],)),
+        'media_coverage': (analyze_media_coverage, (cv_data['media_coverage'], cv_data['name'])),
+    }
+    tasks = {section: task for section, task in tasks.items() if section not in labelled}
+    
+    fresh, durations = run_concurrent_stage(
+        tasks,
+        max_workers=max_workers or ANALYSIS_MAX_WORKERS,
+        timeout=timeout if timeout is not None else ANALYSIS_TIMEOUT
+    )
+    
+    for section, seconds in durations.items():
+        print(f"Labelled {section} in {seconds:.2f}s")
+    if timings is not None:
+        timings.update(durations)
+    
+    # Shallow copy is enough: every labelled section is a fresh list from the LLM
     enriched_cv = cv_data.copy()
+    enriched_cv.update(labelled)
+    enriched_cv.update(fresh)
     
-    enriched_cv['education'] = analyze_education(cv_data['education'])
-    enriched_cv['awards'] = analyze_awards(cv_data['awards'])
-    enriched_cv['publications'] = analyze_publications(cv_data['publications'])
-    enriched_cv['employment_history'] = analyze_employment(cv_data['employment_history'])
-    enriched_cv['media_coverage'] = analyze_media_coverage(cv_data['media_coverage'], cv_data['name'])
+    return enriched_cv
+
+# Record-level labellers used by analyze_cv_incremental; each labels a list of records
+# and returns one labelled record per input
+RECORD_ANALYZERS = {
+    'education': analyze_education,
+    'awards': analyze_awards,
+    'publications': analyze_publications,
+    'employment_history': analyze_employment,
+}
+
+def analyze_cv_incremental(cv_data: Dict[str, Any], previous: Optional[Dict[str, Any]], max_workers: Optional[int] = None,
+                           timeout: Optional[float] = None, timings: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """
+    Like analyze_cv, but reuses the labels of records that are unchanged since `previous`
+    (a snapshot from incremental.load_snapshot) and only sends new or changed records
+    to the LLM. Media coverage is relabelled only if it changed as a whole.
+    """
+    if not previous:
+        return analyze_cv(cv_data, max_workers, timeout, timings)
+    previous_input = previous['enriched_cv_data']
+    previous_output = previous['analysed_cv']
+    
+    # Publication rule labels depend on the research fields as well as the records
+    extra_args = {'publications': (cv_data.get('predicted_research_fields'),)}
+    reused = {}
+    tasks = {}
+    for section, analyzer in RECORD_ANALYZERS.items():
+        labelled, changed = split_changed_records(cv_data[section], previous_input.get(section), previous_output.get(section))
+        reused[section] = (labelled, changed)
+        if changed:
+            tasks[section] = (analyzer, ([cv_data[section][i] for i in changed],) + extra_args.get(section, ()))
+        print(f"Reusing labels for {len(labelled) - len(changed)} {section} records, labelling {len(changed)}")
+    if cv_data['media_coverage'] != previous_input.get('media_coverage') or cv_data['name'] != previous_input.get('name') or 'media_coverage' not in previous_output:
+        tasks['media_coverage'] = (analyze_media_coverage, (cv_data['media_coverage'], cv_data['name']))
+    
+    fresh, durations = run_concurrent_stage(
+        tasks,
+        max_workers=max_workers or ANALYSIS_MAX_WORKERS,
+        timeout=timeout if timeout is not None else ANALYSIS_TIMEOUT
+    ) if tasks else ({}, {})
+    
+    for section, seconds in durations.items():
+        print(f"Labelled {section} in {seconds:.2f}s")
+    if timings is not None:
+        timings.update(durations)
+    
+    enriched_cv = cv_data.copy()
+    for section, (labelled, changed) in reused.items():
+        if section in fresh:
+            if len(fresh[section]) != len(changed):
+                # The labels cannot be matched back to their records, so label the whole section
+                fresh[section] = RECORD_ANALYZERS[section](cv_data[section], *extra_args.get(section, ()))
+                changed = list(range(len(cv_data[section])))
+                labelled = [None] * len(changed)
+            for i, record in zip(changed, fresh[section]):
+                labelled[i] = record
+        enriched_cv[section] = labelled
+    enriched_cv['media_coverage'] = fresh['media_coverage'] if 'media_coverage' in fresh else previous_output['media_coverage']
     
     return enriched_cv
 
@@ -373,7 +596,8 @@ def generate_insights(enriched_cv: Dict[str, Any]) -> str:
     Enriched CV data: {json.dumps(enriched_cv)}
     """
     
-    response = client.chat.completions.create(
+    response = create_chat_completion(
+        client,
         model="gpt-4o",
         messages=[
             {"role": "system", "content": "You are an expert in analyzing academic and research profiles. Provide concise and meaningful insights about the researcher's extraordinary capabilities and contributions, including their impact in different research fields and public recognition."},
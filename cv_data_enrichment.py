@@ -1,102 +1,123 @@
 import json
 import os
+import itertools
+import threading
 import requests
-from fuzzywuzzy import fuzz
-import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterable, Iterator, Tuple
 from urllib.parse import quote
-from time import sleep
+from requests.adapters import HTTPAdapter
+from semantic_scholar import S2_MAX_CONCURRENCY, search_semantic_scholar, resolve_publications, cache_stats
+from incremental import split_changed_records
+
+# "search" looks up each publication by title; "batch" resolves DOIs through
+# /paper/batch and the rest against the author's paper list, falling back to search
+S2_ENRICHMENT_MODE = os.environ.get("S2_ENRICHMENT_MODE", "search")
+
+# Outlets searched for media coverage, as {name: domain}; override with a JSON object in MEDIA_OUTLETS
+DEFAULT_MEDIA_OUTLETS = {
+    "New York Times": "nytimes.com",
+    "Washington Post": "washingtonpost.com",
+    "Wall Street Journal": "wsj.com",
+    "CNN": "cnn.com",
+}
+MEDIA_OUTLETS = json.loads(os.environ["MEDIA_OUTLETS"]) if os.environ.get("MEDIA_OUTLETS") else DEFAULT_MEDIA_OUTLETS
+# Outlet searches in flight at once, and (connect, read) timeout in seconds for each one
+MEDIA_MAX_CONCURRENCY = int(os.environ.get("MEDIA_MAX_CONCURRENCY", 4))
+MEDIA_SEARCH_TIMEOUT = (5, float(os.environ.get("MEDIA_SEARCH_TIMEOUT", 30)))
+
+_media_session = None
+_media_session_lock = threading.Lock()
 
 def load_cv_data(file_path):
     with open(file_path, 'r') as file:
         return json.load(file)
 
-def search_semantic_scholar(title, author_name):
-    base_url = "https://api.semanticscholar.org/graph/v1"
-    
-    api_key = os.environ.get("S2_API_KEY")
-    if not api_key:
-        print("Warning: S2_API_KEY not found in environment variables. Proceeding without API key.")
-    
-    def fuzzy_match(s1, s2, threshold=80):
-        return fuzz.ratio(s1.lower(), s2.lower()) >= threshold
-
-    # simple validation of author name for cases like match Yann LeCun with "LeCun, Y."
-    def validate_author(api_author, given_author):
-        '''
-        api_name = api_author.lower()
-        given_name = given_author.lower()
-        # Yann LeCun <-> "LeCun, Y."
-        if api_name == given_name:
-            return True
-        # Yann LeCun <-> "LeCun, Y."
-        initials_last = re.match(r'^(\w)\w* (\w+)$', given_name)
-        if initials_last:
-            pattern = f'^{initials_last.group(1)}\\w* {initials_last.group(2)}$'
-            if re.match(pattern, api_name, re.IGNORECASE):
-                return True
-        return fuzzy_match(api_name, given_name, threshold=85)
-        '''
-        return True
-
-    search_url = f"{base_url}/paper/search"
-    params = {
-        "query": title,
-        "fields": "title,externalIds,year,citationCount,authors,venue,publicationVenue",
-        "limit": 10
-    }
-
-    headers = {"x-api-key": api_key} if api_key else {}
-
-    response = requests.get(search_url, params=params, headers=headers)
-    
-    if response.status_code != 200:
-        print(f"Error: API request failed with status code {response.status_code}")
-        print(f"Response: {response.text}")
-        return None
-
-    data = response.json()
-
-    if 'data' not in data:
-        print(f"Unexpected data structure: {data}")
-        return None
-
-    papers = data['data']
-
-    for paper in papers:
-        if fuzzy_match(paper['title'], title):
-            for author in paper.get('authors', []):
-                if validate_author(author.get('name', ''), author_name):
-                    venue_info = paper.get('publicationVenue') or {}
-                    return {
-                        "title": paper['title'],
-                        "doi": paper.get('externalIds', {}).get('DOI'),
-                        "year": paper.get('year'),
-                        "citation_count": paper.get('citationCount'),
-                        "venue": paper.get('venue'),
-                        "venue_id": venue_info.get('id'),
-                        "venue_name": venue_info.get('name'),
-                        "venue_type": venue_info.get('type'),
-                        "venue_url": venue_info.get('url')
-                    }
-
-    return None
-
-def enrich_cv_data(cv_data):
+def enrich_publication(pub, author_name):
+    print(f"Searching for: {pub['title']}")
+    enriched_pub = pub.copy()
+    # Author validation stays off: CV author strings like "LeCun, Y." rarely match S2 names verbatim
+    result = search_semantic_scholar(pub['title'], author_name, validate_authors=False)
+    if result:
+        print(f"Match found: {result['title']}")
+        enriched_pub.update(result)
+    else:
+        print(f"No match found for: {pub['title']}")
+    return enriched_pub
+
+def enrich_publications_batch(publications, author_name, max_workers):
+    print(f"Resolving {len(publications)} publications in batch mode")
+    results = resolve_publications(publications, author_name)
     enriched_publications = []
-    for pub in cv_data['publications']:
-        print(f"Searching for: {pub['title']}")
+    missing = []
+    for i, (pub, result) in enumerate(zip(publications, results)):
         enriched_pub = pub.copy()
-        result = search_semantic_scholar(pub['title'], cv_data['name'])
         if result:
-            print(f"Match found: {result['title']}")
             enriched_pub.update(result)
         else:
-            print(f"No match found for: {pub['title']}")
+            missing.append(i)
         enriched_publications.append(enriched_pub)
-        sleep(0.5) #don't overload the API
+
+    if missing:
+        print(f"Falling back to title search for {len(missing)} publications")
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            fallback = executor.map(lambda i: enrich_publication(publications[i], author_name), missing)
+            for i, enriched_pub in zip(missing, fallback):
+                enriched_publications[i] = enriched_pub
+    return enriched_publications
+
+def enrich_publications(publications, author_name, max_workers=None, mode=None):
+    # Lookups share one pooled, rate-limited S2 client, so running them
+    # concurrently keeps the request rate at the key's quota without fixed sleeps
+    max_workers = max_workers or S2_MAX_CONCURRENCY
+    mode = mode or S2_ENRICHMENT_MODE
+    if mode == "batch":
+        enriched_publications = enrich_publications_batch(publications, author_name, max_workers)
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            enriched_publications = list(executor.map(
+                lambda pub: enrich_publication(pub, author_name),
+                publications
+            ))
     
+    stats = cache_stats()
+    if stats:
+        print(f"Semantic Scholar cache: {stats['hits']} hits, {stats['misses']} misses")
+    return enriched_publications
+
+def iter_enriched_publications(publications, author_name, max_workers=None, mode=None) -> Iterator[Tuple[int, dict]]:
+    """
+    Yield (index, enriched publication) pairs as lookups finish, so a downstream stage
+    can start on early results. In batch mode the batch-resolved publications come first,
+    then title-search fallbacks as each completes.
+    """
+    max_workers = max_workers or S2_MAX_CONCURRENCY
+    mode = mode or S2_ENRICHMENT_MODE
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        if mode == "batch":
+            print(f"Resolving {len(publications)} publications in batch mode")
+            futures = {}
+            for i, (pub, result) in enumerate(zip(publications, resolve_publications(publications, author_name))):
+                if result:
+                    enriched_pub = pub.copy()
+                    enriched_pub.update(result)
+                    yield i, enriched_pub
+                else:
+                    futures[executor.submit(enrich_publication, pub, author_name)] = i
+            if futures:
+                print(f"Falling back to title search for {len(futures)} publications")
+        else:
+            futures = {executor.submit(enrich_publication, pub, author_name): i for i, pub in enumerate(publications)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+    stats = cache_stats()
+    if stats:
+        print(f"Semantic Scholar cache: {stats['hits']} hits, {stats['misses']} misses")
+
+def enrich_cv_data(cv_data, max_workers=None, mode=None):
     enriched_cv_data = cv_data.copy()
-    enriched_cv_data['publications'] = enriched_publications
+    enriched_cv_data['publications'] = enrich_publications(cv_data['publications'], cv_data['name'], max_workers, mode)
     
     print("Searching for media coverage...")
     media_coverage = search_media_coverage(cv_data['name'])
@@ -104,14 +125,92 @@ def enrich_cv_data(cv_data):
     
     return enriched_cv_data
 
-def search_media_coverage(person_name):
-    major_media = {
-        "New York Times": "nytimes.com",
-        "Washington Post": "washingtonpost.com",
-        "Wall Street Journal": "wsj.com",
-        "CNN": "cnn.com",
-    }
+def enrich_cv_data_incremental(cv_data, previous, max_workers=None, mode=None):
+    """
+    Like enrich_cv_data, but reuses the enrichment of publications that are unchanged
+    since `previous` (a snapshot from incremental.load_snapshot) and the media coverage
+    when the applicant's name is the same.
+    """
+    if not previous:
+        return enrich_cv_data(cv_data, max_workers, mode)
+    enriched_publications, changed = split_changed_records(
+        cv_data['publications'],
+        previous['cv_data'].get('publications'),
+        previous['enriched_cv_data'].get('publications')
+    )
+    print(f"Reusing enrichment for {len(enriched_publications) - len(changed)} publications, enriching {len(changed)}")
+    if changed:
+        fresh = enrich_publications([cv_data['publications'][i] for i in changed], cv_data['name'], max_workers, mode)
+        for i, enriched_pub in zip(changed, fresh):
+            enriched_publications[i] = enriched_pub
+    
+    enriched_cv_data = cv_data.copy()
+    enriched_cv_data['publications'] = enriched_publications
+    if cv_data['name'] == previous['cv_data'].get('name') and 'media_coverage' in previous['enriched_cv_data']:
+        enriched_cv_data['media_coverage'] = previous['enriched_cv_data']['media_coverage']
+    else:
+        print("Searching for media coverage...")
+        enriched_cv_data['media_coverage'] = search_media_coverage(cv_data['name'])
+    
+    return enriched_cv_data
 
+def get_media_session() -> requests.Session:
+    global _media_session
+    with _media_session_lock:
+        if _media_session is None:
+            _media_session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, MEDIA_MAX_CONCURRENCY))
+            _media_session.mount("https://", adapter)
+        return _media_session
+
+def parse_media_results(lines: Iterable[str], media_name: str, domain: str) -> Iterator[dict]:
+    """
+    Parse Jina search results from an iterable of response lines, yielding each result
+    as soon as its block (lines up to the next blank line) is complete.
+    """
+    block = []
+    for line in itertools.chain(lines, [""]):
+        if line.strip():
+            block.append(line)
+            continue
+        if not block or not block[0].startswith('['):
+            block = []
+            continue
+        coverage = {
+            "media_name": media_name,
+            "media_domain": domain,
+            "title": "",
+            "url_source": "",
+            "description": "",
+            "published_time": ""
+        }
+        for entry in block:
+            if entry.startswith('[') and '] Title:' in entry:
+                coverage["title"] = entry.split('] Title: ', 1)[1]
+            elif entry.startswith('[') and '] URL Source:' in entry:
+                coverage["url_source"] = entry.split('] URL Source: ', 1)[1]
+            elif entry.startswith('[') and '] Description:' in entry:
+                coverage["description"] = entry.split('] Description: ', 1)[1]
+            elif entry.startswith('[') and '] Published Time:' in entry:
+                coverage["published_time"] = entry.split('] Published Time: ', 1)[1]
+        block = []
+        if coverage["title"] and coverage["url_source"]:
+            yield coverage
+
+def search_outlet(person_name, media_name, domain, headers):
+    query = f"{person_name} site:{domain}"
+    url = f'https://s.jina.ai/{quote(query)}'
+    try:
+        with get_media_session().get(url, headers=headers, stream=True, timeout=MEDIA_SEARCH_TIMEOUT) as response:
+            response.raise_for_status()
+            response.encoding = response.encoding or "utf-8"
+            return list(parse_media_results(response.iter_lines(decode_unicode=True), media_name, domain))
+    except requests.RequestException as e:
+        print(f"Error searching {media_name}: {str(e)}")
+        return []
+
+def search_media_coverage(person_name, outlets=None):
+    outlets = outlets or MEDIA_OUTLETS
     jina_api_key = os.environ.get("JINA_READER_API_KEY")
     if not jina_api_key:
         print("Warning: JINA_READER_API_KEY not found in environment variables. Skipping media coverage search.")
@@ -121,56 +220,28 @@ def search_media_coverage(person_name):
         'Authorization': f'Bearer {jina_api_key}'
     }
 
-    media_coverage = []
-
-    for media_name, domain in major_media.items():
-        query = f"{person_name} site:{domain}"
-        encoded_query = quote(query)
-        url = f'https://s.jina.ai/{encoded_query}'
-
-        try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            results = response.text.split('\n\n')
-
-            for result in results:
-                if result.startswith('['):
-                    lines = result.split('\n')
-                    coverage = {
-                        "media_name": media_name,
-                        "media_domain": domain,
-                        "title": "",
-                        "url_source": "",
-                        "description": "",
-                        "published_time": ""
-                    }
-                    for line in lines:
-                        if line.startswith('[') and '] Title:' in line:
-                            coverage["title"] = line.split('] Title: ', 1)[1]
-                        elif line.startswith('[') and '] URL Source:' in line:
-                            coverage["url_source"] = line.split('] URL Source: ', 1)[1]
-                        elif line.startswith('[') and '] Description:' in line:
-                            coverage["description"] = line.split('] Description: ', 1)[1]
-                        elif line.startswith('[') and '] Published Time:' in line:
-                            coverage["published_time"] = line.split('] Published Time: ', 1)[1]
-                    
-                    if coverage["title"] and coverage["url_source"]:
-                        media_coverage.append(coverage)
-
-        except requests.RequestException as e:
-            print(f"Error searching {media_name}: {str(e)}")
-        sleep(0.5)
+    # Outlets are searched concurrently over one pooled session; results keep the
+    # outlet order and each article appears once even if several searches return it
+    with ThreadPoolExecutor(max_workers=max(1, min(MEDIA_MAX_CONCURRENCY, len(outlets)))) as executor:
+        results = list(executor.map(
+            lambda outlet: search_outlet(person_name, outlet[0], outlet[1], headers),
+            outlets.items()
+        ))
 
+    media_coverage = []
+    seen_urls = set()
+    for coverage in itertools.chain.from_iterable(results):
+        url_key = coverage["url_source"].strip().rstrip('/').lower()
+        if url_key not in seen_urls:
+            seen_urls.add(url_key)
+            media_coverage.append(coverage)
     return media_coverage
 
 def main():
     cv_data = load_cv_data('cv_data.json')
+    # enrich_cv_data already includes the media coverage search
     enriched_data = enrich_cv_data(cv_data)
     
-    print("Searching for media coverage...")
-    media_coverage = search_media_coverage(cv_data['name'])
-    enriched_data['media_coverage'] = media_coverage
-    
     with open('enriched_cv_data.json', 'w') as f:
         json.dump(enriched_data, f, indent=2)
     
@@ -1,12 +1,30 @@
 import json
 import os
-from typing import List, Dict, Any, Union
-from pydantic import BaseModel, Field
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Dict, Any, Optional, Union
+from pydantic import BaseModel, Field, ValidationError
 from openai import OpenAI
+from llm_cache import create_chat_completion
 
 # Initialize OpenAI client
 client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
+CATEGORIES = [
+    "Awards", "Membership", "Press", "Judging", "Original contribution",
+    "Scholarly articles", "Critical employment", "High remuneration"
+]
+
+# Bump when the evaluate_category prompt changes so checkpointed evaluations are redone
+EVALUATION_PROMPT_VERSION = 1
+
+# "per_category" sends one request per category; "combined" rates every category in a
+# single structured call (see benchmark_evaluator.py to compare them)
+EVALUATION_MODE = os.environ.get("EVALUATION_MODE", "per_category")
+
+# Upper bound on concurrent evaluate_category requests
+EVALUATION_MAX_WORKERS = int(os.environ.get("EVALUATION_MAX_WORKERS", len(CATEGORIES)))
+
 class CategoryRating(BaseModel):
     category: str
     rating: str
@@ -20,11 +38,23 @@ class O1AEvaluation(BaseModel):
     education: List[Dict[str, Any]]
     category_ratings: List[CategoryRating]
 
+_usage_lock = threading.Lock()
+
+def add_usage(usage: Optional[Dict[str, int]], response) -> None:
+    # Accumulate token counts of a completion into a caller-supplied dict
+    if usage is None or getattr(response, "usage", None) is None:
+        return
+    with _usage_lock:
+        usage["requests"] = usage.get("requests", 0) + 1
+        usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + response.usage.prompt_tokens
+        usage["completion_tokens"] = usage.get("completion_tokens", 0) + response.usage.completion_tokens
+
 def load_json_data(file_path: str) -> Dict[str, Any]:
     with open(file_path, 'r') as file:
         return json.load(file)
 
-def evaluate_category(category: str, data: Dict[str, Any]) -> Dict[str, Any]:
+def category_inputs(category: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Everything evaluate_category reads from `data` for one category."""
     # Prepare relevant data for each category
     category_data = {
         "Awards": data.get("awards", []) + data.get("major_awards", []),
@@ -40,12 +70,16 @@ def evaluate_category(category: str, data: Dict[str, Any]) -> Dict[str, Any]:
     all_fields = list(data.keys())
     relevant_fields = list(category_data.keys())
     unused_fields = [field for field in all_fields if field not in relevant_fields]
+    return {"category_data": category_data[category], "unused_fields": unused_fields}
+
+def evaluate_category(category: str, data: Dict[str, Any], use_cache: bool = True, usage: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    inputs = category_inputs(category, data)
 
     prompt = f"""
     Based solely on the following data for an O-1A visa applicant, evaluate their qualification for the category: {category}
     
     Relevant data for {category}:
-    {json.dumps(category_data[category], indent=2)}
+    {json.dumps(inputs["category_data"], indent=2)}
     
     Additional context:
     - For publications and media coverage, consider the 'extraordinary' label, which indicates high citation count, venue reputation, or significance of the coverage.
@@ -65,7 +99,9 @@ def evaluate_category(category: str, data: Dict[str, Any]) -> Dict[str, Any]:
     }}
     """
     
-    response = client.chat.completions.create(
+    response = create_chat_completion(
+        client,
+        use_cache=use_cache,
         model="gpt-4o",
         messages=[
             {"role": "system", "content": "You are an expert in evaluating O-1A visa applications. Use only the provided data for your evaluation."},
@@ -73,22 +109,129 @@ def evaluate_category(category: str, data: Dict[str, Any]) -> Dict[str, Any]:
         ],
         response_format={"type": "json_object"}
     )
+    add_usage(usage, response)
     
     evaluation = json.loads(response.choices[0].message.content)
-    evaluation["information_unused"] += [field for field in unused_fields]
+    evaluation["information_unused"] += [field for field in inputs["unused_fields"]]
     return evaluation
 
+def evaluate_all_categories(categories: List[str], data: Dict[str, Any], use_cache: bool = True,
+                            usage: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+    """
+    Rate every category in one structured tool call, sharing the instructions across
+    categories. Each rating is validated through CategoryRating; categories the model
+    leaves out or returns malformed are evaluated on their own with evaluate_category.
+    """
+    inputs = {category: category_inputs(category, data) for category in categories}
+    sections = "\n\n".join(
+        f"Relevant data for {category}:\n{json.dumps(inputs[category]['category_data'], indent=2)}"
+        for category in categories
+    )
+    prompt = f"""
+    Based solely on the following data for an O-1A visa applicant, evaluate their qualification for each of these categories: {", ".join(categories)}
+    
+    {sections}
+    
+    Additional context:
+    - For publications and media coverage, consider the 'extraordinary' label, which indicates high citation count, venue reputation, or significance of the coverage.
+    - For employment, consider the 'is_critical_capacity' and 'extraordinary' fields.
+    - Do not use any preexisting knowledge about the person, only the provided data.
+    - Evaluate each category only from its own relevant data.
+    
+    For each category, provide a rating (low, medium, or high) on the chance that this person is qualified for an O-1A immigration visa in that category.
+    Justify each rating in up to 200 words using only the related data provided.
+    Also, list the specific pieces of information you used in each judgment, and those you didn't use.
+    """
+    
+    response = create_chat_completion(
+        client,
+        use_cache=use_cache,
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": "You are an expert in evaluating O-1A visa applications. Use only the provided data for your evaluation."},
+            {"role": "user", "content": prompt}
+        ],
+        tools=[{
+            "type": "function",
+            "function": {
+                "name": "rate_categories",
+                "description": "Rate the applicant in every O-1A category",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "category_ratings": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "category": {"type": "string", "enum": categories},
+                                    "rating": {"type": "string", "enum": ["low", "medium", "high"]},
+                                    "justification": {"type": "string"},
+                                    "information_used": {"type": "array", "items": {"type": "string"}},
+                                    "information_unused": {"type": "array", "items": {"type": "string"}}
+                                },
+                                "required": ["category", "rating", "justification", "information_used", "information_unused"]
+                            }
+                        }
+                    },
+                    "required": ["category_ratings"]
+                }
+            }
+        }],
+        tool_choice={"type": "function", "function": {"name": "rate_categories"}}
+    )
+    add_usage(usage, response)
+    
+    ratings = {}
+    for item in json.loads(response.choices[0].message.tool_calls[0].function.arguments)["category_ratings"]:
+        try:
+            rating = CategoryRating.model_validate(item)
+        except ValidationError:
+            continue
+        if rating.category in inputs and rating.category not in ratings:
+            evaluation = rating.model_dump(exclude={"category"})
+            evaluation["information_unused"] += inputs[rating.category]["unused_fields"]
+            ratings[rating.category] = evaluation
+    
+    missing = [category for category in categories if category not in ratings]
+    if missing:
+        print(f"Combined evaluation left out {', '.join(missing)}; evaluating them separately")
+        ratings.update(zip(missing, evaluate_categories(missing, data, use_cache=use_cache, usage=usage, mode="per_category")))
+    return [ratings[category] for category in categories]
+
+def evaluate_categories(categories: List[str], data: Dict[str, Any], max_workers: Optional[int] = None,
+                        on_result: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                        mode: Optional[str] = None, use_cache: bool = True,
+                        usage: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+    mode = mode or EVALUATION_MODE
+    if mode == "combined":
+        evaluations = evaluate_all_categories(categories, data, use_cache=use_cache, usage=usage)
+        if on_result is not None:
+            for category, evaluation in zip(categories, evaluations):
+                on_result(category, evaluation)
+        return evaluations
+    
+    # Each category is an independent request, so run them concurrently.
+    # Results are returned in the order of `categories`, which keeps downstream
+    # aggregation deterministic regardless of completion order; `on_result` is
+    # called with each category as soon as its evaluation finishes.
+    max_workers = max_workers or EVALUATION_MAX_WORKERS
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(categories)))) as executor:
+        futures = {executor.submit(evaluate_category, category, data, use_cache, usage): category for category in categories}
+        if on_result is not None:
+            for future in as_completed(futures):
+                if future.exception() is None:
+                    on_result(futures[future], future.result())
+        by_category = {category: future.result() for future, category in futures.items()}
+    return [by_category[category] for category in categories]
+
 def main():
     data = load_json_data("further_enriched_cv_data.json")
     
-    categories = [
-        "Awards", "Membership", "Press", "Judging", "Original contribution",
-        "Scholarly articles", "Critical employment", "High remuneration"
-    ]
+    evaluations = evaluate_categories(CATEGORIES, data)
     
     category_ratings = []
-    for category in categories:
-        evaluation = evaluate_category(category, data)
+    for category, evaluation in zip(CATEGORIES, evaluations):
         category_ratings.append(CategoryRating(
             category=category,
             rating=evaluation["rating"],
@@ -1,10 +1,16 @@
 import os
+import json
+import asyncio
 import traceback
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
-from workflow_driver import process_cv, generate_markdown_summary
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from workflow_driver import process_cv, invalidate_cached_result
+from job_queue import JobQueue, QueueFull, QUEUED, RUNNING, FAILED
 import tempfile
 import logging
+from typing import Optional
 
 app = FastAPI()
 
@@ -12,25 +18,120 @@ app = FastAPI()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# process_cv is synchronous, so each request runs it on this bounded pool instead of the
+# event loop; uploads beyond the limit queue here rather than starting more pipelines
+PIPELINE_MAX_CONCURRENCY = int(os.environ.get("PIPELINE_MAX_CONCURRENCY", 8))
+pipeline_executor = ThreadPoolExecutor(max_workers=PIPELINE_MAX_CONCURRENCY, thread_name_prefix="process_cv")
+
+async def run_pipeline(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pipeline_executor, func, *args)
+
+# Uploads are streamed to disk in UPLOAD_CHUNK_SIZE pieces and rejected once they pass
+# MAX_UPLOAD_BYTES or if they do not start like a PDF
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# The PDF header must appear within the first 1024 bytes of the file
+PDF_HEADER = b"%PDF-"
+PDF_HEADER_WINDOW = 1024
+# Room for the multipart boundaries and part headers around the file in a request body
+MULTIPART_OVERHEAD = 64 * 1024
+
+@app.middleware("http")
+async def reject_oversized_body(request: Request, call_next):
+    # The form is parsed (and the whole body spooled) before an endpoint runs, so a body
+    # that announces itself as too large is refused here, before any of it is read.
+    # Bodies without a Content-Length are still capped by save_upload.
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD:
+        return JSONResponse(status_code=413, content={"detail": f"Uploaded file exceeds {MAX_UPLOAD_BYTES} bytes"})
+    return await call_next(request)
+
+async def save_upload(file: UploadFile, directory: Optional[str] = None) -> str:
+    """
+    Spool an upload to a temporary .pdf file without holding it in memory and return
+    its path. Raises 415 for payloads that are not PDFs and 413 for oversized ones.
+    """
+    size = 0
+    head = b""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf", dir=directory) as spool:
+        try:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if len(head) < PDF_HEADER_WINDOW:
+                    head += chunk[:PDF_HEADER_WINDOW - len(head)]
+                    if len(head) >= PDF_HEADER_WINDOW and PDF_HEADER not in head:
+                        raise HTTPException(status_code=415, detail="Uploaded file is not a PDF")
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Uploaded file exceeds {MAX_UPLOAD_BYTES} bytes")
+                await run_in_threadpool(spool.write, chunk)
+            if PDF_HEADER not in head:
+                raise HTTPException(status_code=415, detail="Uploaded file is not a PDF")
+        except BaseException:
+            spool.close()
+            os.unlink(spool.name)
+            raise
+    return spool.name
+
+# Background jobs: uploads are kept in JOB_UPLOAD_DIR until their job finishes, and job
+# state and results live in JOB_DB_PATH so they survive restarts
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", os.path.join(".cache", "jobs.sqlite"))
+JOB_UPLOAD_DIR = os.environ.get("JOB_UPLOAD_DIR", os.path.join(".cache", "job_uploads"))
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+JOB_MAX_QUEUED = int(os.environ.get("JOB_MAX_QUEUED", 100))
+# Seconds a running job stays claimed without a heartbeat from its process; after that
+# another process serving the same JOB_DB_PATH runs it again
+JOB_LEASE = float(os.environ.get("JOB_LEASE", 60))
+# Seconds a client is asked to wait before resubmitting when the queue is full
+JOB_RETRY_AFTER = 30
+
+def evaluate_pdf(pdf_path: str, on_event=None, cache_info=None) -> dict:
+    # process_cv includes the markdown summary and serves repeat uploads from the result cache
+    return process_cv(pdf_path, on_event=on_event, cache_info=cache_info)
+
+def cache_headers(cache_info: dict) -> dict:
+    headers = {"X-Cache": cache_info.get("status", "bypass").upper()}
+    if cache_info.get("key"):
+        headers["X-Cache-Key"] = cache_info["key"]
+    return headers
+
+def run_job(payload: dict) -> dict:
+    return evaluate_pdf(payload["pdf_path"])
+
+def remove_job_upload(payload: dict):
+    try:
+        os.unlink(payload["pdf_path"])
+    except FileNotFoundError:
+        pass
+
+job_queue = JobQueue(JOB_DB_PATH, run_job, workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED,
+                     on_finish=remove_job_upload, lease=JOB_LEASE)
+
+@app.on_event("startup")
+def start_job_queue():
+    os.makedirs(JOB_UPLOAD_DIR, exist_ok=True)
+    job_queue.start()
+
+@app.on_event("shutdown")
+def shutdown_pipeline_executor():
+    pipeline_executor.shutdown(wait=False, cancel_futures=True)
+    job_queue.stop(timeout=0)
+
 @app.post("/process_cv/")
 async def process_cv_endpoint(file: UploadFile = File(...)):
     # Create a temporary file to store the uploaded PDF
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-        temp_file.write(await file.read())
-        temp_file_path = temp_file.name
+    temp_file_path = await save_upload(file)
 
     try:
-        # Process the CV
-        result = process_cv(temp_file_path)
-        
-        # Generate markdown summary
-        summary = generate_markdown_summary(result)
-        
-        # Add the summary to the result
-        result["markdown_summary"] = summary
+        # Process the CV, or fetch the stored evaluation of an identical upload
+        cache_info = {}
+        result = await run_pipeline(evaluate_pdf, temp_file_path, None, cache_info)
         
         # Return the full output as JSON
-        return JSONResponse(content=result)
+        return JSONResponse(content=result, headers=cache_headers(cache_info))
     except Exception as e:
         logger.error(f"Error processing CV: {str(e)}")
         logger.error(traceback.format_exc())
@@ -39,6 +140,93 @@ async def process_cv_endpoint(file: UploadFile = File(...)):
         # Clean up the temporary file
         os.unlink(temp_file_path)
 
+@app.delete("/process_cv/cache")
+def clear_result_cache():
+    invalidate_cached_result()
+    return {"cleared": True}
+
+@app.delete("/process_cv/cache/{key}")
+def invalidate_result(key: str):
+    # key is the X-Cache-Key header returned with an evaluation
+    invalidate_cached_result(key=key)
+    return {"invalidated": key}
+
+# Pipeline runs behind /process_cv/stream, referenced until they finish
+stream_tasks = set()
+
+def format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/process_cv/stream")
+async def process_cv_stream_endpoint(file: UploadFile = File(...)):
+    """
+    Same pipeline as /process_cv/, streamed as server-sent events: one event per finished
+    stage (parsed_cv, research_fields, enriched_publications, labelled_sections, one
+    category_rating per category, insights), then `result` with the full output or `error`.
+    """
+    temp_file_path = await save_upload(file)
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def on_event(name, data):
+        # Called from pipeline threads; hand the event over to the event loop
+        loop.call_soon_threadsafe(events.put_nowait, (name, data))
+
+    async def run():
+        try:
+            result = await run_pipeline(evaluate_pdf, temp_file_path, on_event)
+            await events.put(("result", result))
+        except Exception as e:
+            logger.error(f"Error processing CV: {str(e)}")
+            logger.error(traceback.format_exc())
+            await events.put(("error", {"detail": f"Error processing CV: {str(e)}"}))
+        finally:
+            os.unlink(temp_file_path)
+
+    async def stream():
+        # A client that disconnects early stops receiving events, but the run still
+        # completes and cleans up its upload
+        task = asyncio.create_task(run())
+        stream_tasks.add(task)
+        task.add_done_callback(stream_tasks.discard)
+        while True:
+            name, data = await events.get()
+            yield format_sse(name, data)
+            if name in ("result", "error"):
+                break
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...)):
+    pdf_path = await save_upload(file, directory=JOB_UPLOAD_DIR)
+    try:
+        job_id = job_queue.submit({"pdf_path": pdf_path, "filename": file.filename})
+    except QueueFull as e:
+        os.unlink(pdf_path)
+        raise HTTPException(status_code=429, detail=f"Job queue is full: {e}", headers={"Retry-After": str(JOB_RETRY_AFTER)})
+    return {"job_id": job_id, "status": QUEUED}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] in (QUEUED, RUNNING):
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    if job["status"] == FAILED:
+        raise HTTPException(status_code=500, detail=f"Error processing CV: {job['error']}")
+    # The result is stored as JSON text, so repeat fetches are a single row read
+    return Response(content=job_queue.result_json(job_id), media_type="application/json")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
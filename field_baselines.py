@@ -0,0 +1,75 @@
+import os
+import re
+import json
+import threading
+from typing import Any, Dict, List, Optional
+
+from fuzzywuzzy import fuzz, process
+
+from publication_scoring import field_discipline
+
+# Versioned table of median publication and citation counts per research field; bump its
+# "version" when the numbers change
+FIELD_BASELINES_PATH = os.environ.get("FIELD_BASELINES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "field_baselines.json"))
+# Minimum fuzzy match score (0-100) for a field name that is not in the table verbatim
+FIELD_MATCH_THRESHOLD = int(os.environ.get("FIELD_MATCH_THRESHOLD", 85))
+
+class FieldBaselines:
+    """
+    In-memory index over the field baseline table. Lookups normalize the field name and
+    try an exact match, then an alias, then the closest table entry, then the entry of
+    the field's discipline (see publication_scoring.field_discipline).
+    """
+
+    def __init__(self, path: str):
+        with open(path, "r") as file:
+            data = json.load(file)
+        self.version = data["version"]
+        self.fields: Dict[str, Dict[str, Any]] = {normalize_field(name): stats for name, stats in data["fields"].items()}
+        self.aliases = {normalize_field(alias): normalize_field(name) for alias, name in data.get("aliases", {}).items()}
+        self._names = list(self.fields)
+        self._matches: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+
+    def match(self, field: str) -> Optional[str]:
+        """The table entry used for `field`, or None if nothing matches."""
+        name = normalize_field(field)
+        name = self.aliases.get(name, name)
+        if name in self.fields:
+            return name
+        with self._lock:
+            if name not in self._matches:
+                best = process.extractOne(name, self._names, scorer=fuzz.token_sort_ratio, score_cutoff=FIELD_MATCH_THRESHOLD)
+                discipline = normalize_field(field_discipline([field]))
+                self._matches[name] = best[0] if best else (discipline if discipline in self.fields else None)
+            return self._matches[name]
+
+    def get(self, field: str) -> Optional[Dict[str, Any]]:
+        name = self.match(field)
+        return self.fields[name] if name is not None else None
+
+def normalize_field(field: str) -> str:
+    """Lowercase a field name and collapse punctuation and underscores to single spaces."""
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", (field or "").lower()).split())
+
+_baselines = None
+_baselines_lock = threading.Lock()
+
+def get_field_baselines() -> FieldBaselines:
+    global _baselines
+    with _baselines_lock:
+        if _baselines is None:
+            _baselines = FieldBaselines(FIELD_BASELINES_PATH)
+        return _baselines
+
+def field_statistics(fields: List[str]) -> List[Dict[str, Any]]:
+    """Baseline statistics of each field in `fields` that the table covers, in order."""
+    baselines = get_field_baselines()
+    statistics = []
+    for field in fields:
+        name = baselines.match(field)
+        if name is None:
+            print(f"No field baseline for {field}")
+            continue
+        statistics.append({"field": field, "baseline_field": name, "baseline_version": baselines.version, **baselines.fields[name]})
+    return statistics
@@ -0,0 +1,78 @@
+import os
+import re
+from collections import defaultdict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache import MISSING, make_key
+from checkpoints import get_checkpoint_store
+
+# Re-enrich and re-label only the records that changed since the applicant's previous CV
+INCREMENTAL_EVALUATION = os.environ.get("INCREMENTAL_EVALUATION", "0") == "1"
+# Bump when the snapshot layout changes so old snapshots are ignored
+SNAPSHOT_VERSION = 2
+# Snapshot parts in pipeline order, with the stage whose settings produced each
+SNAPSHOT_STAGES = [("enrich", "enriched_cv_data"), ("analyze", "analysed_cv")]
+
+def split_changed_records(records: List[Any], previous_inputs: Optional[List[Any]], previous_outputs: Optional[List[Any]]) -> Tuple[List[Any], List[int]]:
+    """
+    Match each record against the previous run, where previous_outputs[i] is what
+    previous_inputs[i] produced. Returns the reused outputs (None where a record is new
+    or changed) and the indices of the records that still need processing.
+    """
+    if not previous_inputs or previous_outputs is None or len(previous_inputs) != len(previous_outputs):
+        return [None] * len(records), list(range(len(records)))
+    # Identical records may appear more than once, so each previous output is reused at most once
+    reusable = defaultdict(deque)
+    for record, output in zip(previous_inputs, previous_outputs):
+        reusable[make_key(record)].append(output)
+    outputs = []
+    changed = []
+    for i, record in enumerate(records):
+        candidates = reusable.get(make_key(record))
+        if candidates:
+            outputs.append(candidates.popleft())
+        else:
+            outputs.append(None)
+            changed.append(i)
+    return outputs, changed
+
+def applicant_id(cv_data: Dict[str, Any]) -> Optional[str]:
+    identity = (cv_data.get("email") or "").strip().lower() or re.sub(r'\s+', ' ', (cv_data.get("name") or "").strip().lower())
+    return identity or None
+
+def _snapshot_key(applicant: str) -> str:
+    return get_checkpoint_store().key("applicant_snapshot", SNAPSHOT_VERSION, applicant)
+
+def load_snapshot(cv_data: Dict[str, Any], settings: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    The stage outputs of the applicant's previous evaluation, if one was saved. `settings`
+    maps each stage of SNAPSHOT_STAGES to the settings it runs with now (versions, modes,
+    research fields); outputs of a stage whose settings changed, and of every stage after
+    it, are left out so their records are processed again.
+    """
+    applicant = applicant_id(cv_data)
+    if applicant is None:
+        return None
+    snapshot = get_checkpoint_store().get(_snapshot_key(applicant))
+    if snapshot is MISSING:
+        return None
+    saved = snapshot.get("settings", {})
+    for position, (stage, _) in enumerate(SNAPSHOT_STAGES):
+        if make_key(saved.get(stage)) != make_key((settings or {}).get(stage)):
+            if position == 0:
+                print(f"Previous evaluation used different {stage} settings; not reusing it")
+                return None
+            print(f"Previous evaluation used different {stage} settings; relabelling every record")
+            return {**snapshot, **{part: {} for _, part in SNAPSHOT_STAGES[position:]}}
+    return snapshot
+
+def save_snapshot(cv_data: Dict[str, Any], enriched_cv_data: Dict[str, Any], analysed_cv: Dict[str, Any],
+                  settings: Optional[Dict[str, Any]] = None):
+    applicant = applicant_id(cv_data)
+    if applicant is not None:
+        get_checkpoint_store().set(_snapshot_key(applicant), {
+            "cv_data": cv_data,
+            "enriched_cv_data": enriched_cv_data,
+            "analysed_cv": analysed_cv,
+            "settings": settings or {},
+        })
@@ -0,0 +1,183 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when max_queued jobs are already waiting."""
+
+class JobQueue:
+    """
+    Persistent job queue backed by a single SQLite file, drained by a pool of worker threads.
+
+    submit() stores a job and returns its id; workers call `handler(payload)` and store
+    the JSON result (or the error) on the job row, so results survive restarts and are
+    served from the database on every fetch.
+
+    Several processes (e.g. uvicorn workers) may share one database. A job is claimed
+    atomically and holds a lease of `lease` seconds in its owner's name, renewed while
+    the owner is alive; a running job whose lease has expired belonged to a process that
+    stopped, and is queued again for any worker to pick up.
+    """
+
+    def __init__(self, path: str, handler: Callable[[Dict[str, Any]], Any], workers: int = 2,
+                 max_queued: int = 100, on_finish: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 lease: float = 60.0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.on_finish = on_finish
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._beat = threading.Condition(self._lock)
+        self._stopping = False
+        self._threads: List[threading.Thread] = []
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, result TEXT, error TEXT, "
+                "created REAL NOT NULL, started REAL, finished REAL, owner TEXT, lease_until REAL)"
+            )
+            # Databases created before leases were recorded
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created)")
+
+    def start(self):
+        with self._lock:
+            self._requeue_expired()
+            self._stopping = False
+        targets = [(self._work, f"job-worker-{index}") for index in range(self.workers)]
+        for target, name in targets + [(self._heartbeat, "job-heartbeat")]:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        with self._ready:
+            self._stopping = True
+            self._ready.notify_all()
+            self._beat.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, payload: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        with self._ready, self._conn:
+            queued = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+            if queued >= self.max_queued:
+                raise QueueFull(f"{queued} jobs are already queued")
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, payload, created) VALUES (?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(payload), time.time())
+            )
+            self._ready.notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job status without the result body, or None if the id is unknown."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, error, created, started, finished FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            job = dict(zip(("job_id", "status", "error", "created", "started", "finished"), row))
+            if job["status"] == QUEUED:
+                job["position"] = self._conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = ? AND created <= ?", (QUEUED, job["created"])
+                ).fetchone()[0]
+        return job
+
+    def result_json(self, job_id: str) -> Optional[str]:
+        """The stored JSON result text of a finished job, returned without re-encoding."""
+        with self._lock:
+            row = self._conn.execute("SELECT result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def _requeue_expired(self):
+        # Running jobs whose owner stopped renewing the lease; rows from before leases
+        # were recorded have none
+        with self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, started = NULL, owner = NULL, lease_until = NULL "
+                "WHERE status = ? AND (lease_until IS NULL OR lease_until < ?)",
+                (QUEUED, RUNNING, time.time())
+            )
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        with self._ready:
+            while not self._stopping:
+                self._requeue_expired()
+                row = self._conn.execute(
+                    "SELECT id, payload FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    now = time.time()
+                    with self._conn:
+                        # Only succeeds if no other process claimed the job since it was read
+                        claimed = self._conn.execute(
+                            "UPDATE jobs SET status = ?, started = ?, owner = ?, lease_until = ? WHERE id = ? AND status = ?",
+                            (RUNNING, now, self.owner, now + self.lease, row[0], QUEUED)
+                        ).rowcount
+                    if claimed:
+                        return {"job_id": row[0], "payload": json.loads(row[1])}
+                    continue
+                # Jobs submitted to other processes, or requeued from expired leases, are
+                # only noticed by polling
+                self._ready.wait(self.lease / 3)
+        return None
+
+    def _heartbeat(self):
+        with self._beat:
+            while not self._stopping:
+                with self._conn:
+                    self._conn.execute(
+                        "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = ?",
+                        (time.time() + self.lease, self.owner, RUNNING)
+                    )
+                self._beat.wait(self.lease / 3)
+
+    def _work(self):
+        while True:
+            job = self._claim()
+            if job is None:
+                return
+            result, error = None, None
+            try:
+                result = json.dumps(self.handler(job["payload"]))
+                status = SUCCEEDED
+            except Exception as e:
+                print(f"Job {job['job_id']} failed: {e}")
+                traceback.print_exc()
+                error = str(e)
+                status = FAILED
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, lease_until = NULL "
+                    "WHERE id = ? AND owner = ?",
+                    (status, result, error, time.time(), job["job_id"], self.owner)
+                )
+            if self.on_finish is not None:
+                self.on_finish(job["payload"])
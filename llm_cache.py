@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Optional, Union
+
+from openai import OpenAI, RateLimitError
+from openai.types.chat import ChatCompletion
+
+from cache import MISSING, MemoryLRUCache, SQLiteCache, make_key
+from rate_limit import TokenBucket
+
+# "memory" keeps responses for the life of the process, "disk" persists them across runs,
+# "none" disables caching everywhere
+LLM_CACHE_BACKEND = os.environ.get("LLM_CACHE_BACKEND", "memory")
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.join(".cache", "llm.sqlite"))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 2048))
+LLM_CACHE_TTL = float(os.environ["LLM_CACHE_TTL"]) if os.environ.get("LLM_CACHE_TTL") else None
+
+# Process-wide OpenAI request quota shared by every stage and document; tune to the
+# account's requests-per-minute limit (0 disables limiting)
+OPENAI_REQUESTS_PER_MINUTE = float(os.environ.get("OPENAI_REQUESTS_PER_MINUTE", 500))
+OPENAI_BURST = float(os.environ.get("OPENAI_BURST", 10))
+# Attempts after a 429 before the error is raised to the caller
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", 3))
+
+_cache = None
+_cache_lock = threading.Lock()
+# Cleared in offline mode: batch responses must stay cached until the rerun reads them
+_evict = True
+
+rate_limiter = TokenBucket(OPENAI_REQUESTS_PER_MINUTE / 60, OPENAI_BURST) if OPENAI_REQUESTS_PER_MINUTE > 0 else None
+
+class BatchPending(Exception):
+    """Raised in offline mode when a request was queued for the Batch API instead of being sent."""
+
+# Set by openai_batch.enable_offline_mode(); receives (key, request) for every cache miss
+_offline_sink: Optional[Callable[[str, dict], None]] = None
+
+def set_offline_sink(sink: Optional[Callable[[str, dict], None]]):
+    global _offline_sink
+    _offline_sink = sink
+
+def use_disk_cache(evict: bool = True):
+    """
+    Switch to the persistent backend, which offline mode needs to carry responses across
+    runs. With evict=False, LLM_CACHE_MAX_ENTRIES and LLM_CACHE_TTL are not applied.
+    """
+    global _cache, LLM_CACHE_BACKEND, _evict
+    with _cache_lock:
+        if LLM_CACHE_BACKEND != "disk" or _evict != evict:
+            LLM_CACHE_BACKEND = "disk"
+            _evict = evict
+            _cache = None
+
+def get_cache() -> Optional[Union[MemoryLRUCache, SQLiteCache]]:
+    global _cache
+    with _cache_lock:
+        if _cache is None and LLM_CACHE_BACKEND != "none":
+            if LLM_CACHE_BACKEND == "disk" and not _evict:
+                _cache = SQLiteCache(LLM_CACHE_PATH)
+            elif LLM_CACHE_BACKEND == "disk":
+                _cache = SQLiteCache(LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES)
+            else:
+                _cache = MemoryLRUCache(ttl=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES)
+        return _cache
+
+def request_key(request: dict) -> str:
+    """Stable hash of a chat completion request: model, messages, tool schema and options."""
+    return make_key("chat.completions", request)
+
+def create_chat_completion(client: OpenAI, use_cache: bool = True, **request: Any) -> ChatCompletion:
+    """
+    Drop-in replacement for client.chat.completions.create that serves identical
+    requests from the LLM cache. Pass use_cache=False at call sites that must
+    always hit the API.
+    """
+    cache = get_cache() if use_cache else None
+    if cache is not None:
+        key = request_key(request)
+        cached = cache.get(key)
+        if cached is not MISSING:
+            return ChatCompletion.model_validate(cached)
+        if _offline_sink is not None:
+            # The response will be written to the cache when its batch completes
+            _offline_sink(key, request)
+            raise BatchPending(key)
+
+    response = send_rate_limited(client, request)
+
+    if cache is not None:
+        cache.set(key, response.model_dump(mode="json"))
+    return response
+
+def _retry_after(error: RateLimitError, attempt: int) -> float:
+    retry_after = error.response.headers.get("retry-after") if error.response is not None else None
+    if retry_after and retry_after.strip().replace(".", "", 1).isdigit():
+        return float(retry_after)
+    return min(60.0, 2 ** attempt)
+
+def send_rate_limited(client: OpenAI, request: dict) -> ChatCompletion:
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return client.chat.completions.create(**request)
+        except RateLimitError as e:
+            if attempt == OPENAI_MAX_RETRIES:
+                raise
+            delay = _retry_after(e, attempt)
+            print(f"Warning: OpenAI rate limit hit, retrying in {delay:.1f}s")
+            if rate_limiter is not None:
+                # Hold back every thread sharing the quota, not just this one
+                rate_limiter.pause(delay)
+            else:
+                time.sleep(delay)
@@ -0,0 +1,176 @@
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from openai import OpenAI
+
+from llm_cache import get_cache, set_offline_sink, use_disk_cache
+
+# Requests queued for the Batch API and the batches they were submitted in
+BATCH_STATE_PATH = os.environ.get("BATCH_STATE_PATH", os.path.join(".cache", "openai_batch.sqlite"))
+BATCH_POLL_INTERVAL = float(os.environ.get("BATCH_POLL_INTERVAL", 60))
+# The Batch API accepts at most 50,000 requests per input file
+BATCH_MAX_REQUESTS = 50000
+BATCH_COMPLETION_WINDOW = "24h"
+# Batches in these states will not produce any more output
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+_store = None
+_store_lock = threading.Lock()
+
+class BatchStore:
+    """SQLite record of queued chat completion requests, keyed by their LLM cache key."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS requests ("
+                "key TEXT PRIMARY KEY, body TEXT NOT NULL, batch_id TEXT, created REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS batches ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, request_count INTEGER NOT NULL, created REAL NOT NULL)"
+            )
+
+    def add(self, key: str, request: dict):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO requests (key, body, created) VALUES (?, ?, ?)",
+                (key, json.dumps(request), time.time())
+            )
+
+    def unsubmitted(self) -> List[Tuple[str, str]]:
+        with self._lock:
+            return self._conn.execute("SELECT key, body FROM requests WHERE batch_id IS NULL ORDER BY created").fetchall()
+
+    def add_batch(self, batch_id: str, keys: List[str]):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO batches (id, status, request_count, created) VALUES (?, ?, ?, ?)",
+                (batch_id, "validating", len(keys), time.time())
+            )
+            self._conn.executemany("UPDATE requests SET batch_id = ? WHERE key = ?", [(batch_id, key) for key in keys])
+
+    def open_batches(self) -> List[str]:
+        with self._lock:
+            placeholders = ", ".join("?" for _ in TERMINAL_STATUSES)
+            rows = self._conn.execute(f"SELECT id FROM batches WHERE status NOT IN ({placeholders})", TERMINAL_STATUSES).fetchall()
+        return [row[0] for row in rows]
+
+    def finish_batch(self, batch_id: str, status: str, resolved: List[str]):
+        """Record a finished batch, dropping resolved requests and requeueing the rest."""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE batches SET status = ? WHERE id = ?", (status, batch_id))
+            self._conn.executemany("DELETE FROM requests WHERE key = ?", [(key,) for key in resolved])
+            self._conn.execute("UPDATE requests SET batch_id = NULL WHERE batch_id = ?", (batch_id,))
+
+    def set_status(self, batch_id: str, status: str):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE batches SET status = ? WHERE id = ?", (status, batch_id))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            queued = self._conn.execute("SELECT COUNT(*) FROM requests WHERE batch_id IS NULL").fetchone()[0]
+            submitted = self._conn.execute("SELECT COUNT(*) FROM requests WHERE batch_id IS NOT NULL").fetchone()[0]
+        return {"queued": queued, "submitted": submitted}
+
+def get_store() -> BatchStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BatchStore(BATCH_STATE_PATH)
+        return _store
+
+def enable_offline_mode():
+    """
+    Queue every chat completion that misses the LLM cache instead of sending it. Pipeline
+    calls then raise llm_cache.BatchPending; once collect_results() has written the
+    batch responses to the cache, rerunning the pipeline picks up where it stopped.
+    Cache eviction is off meanwhile, so a large cohort cannot push collected responses
+    out before the rerun reads them (and pay for them twice).
+    """
+    use_disk_cache(evict=False)
+    set_offline_sink(get_store().add)
+
+def disable_offline_mode():
+    set_offline_sink(None)
+
+def submit_pending(client: Optional[OpenAI] = None) -> List[str]:
+    """Upload every queued request as Batch API input files and return the new batch ids."""
+    client = client or OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    store = get_store()
+    rows = store.unsubmitted()
+    batch_ids = []
+    for start in range(0, len(rows), BATCH_MAX_REQUESTS):
+        chunk = rows[start:start + BATCH_MAX_REQUESTS]
+        lines = [
+            json.dumps({"custom_id": key, "method": "POST", "url": "/v1/chat/completions", "body": json.loads(body)})
+            for key, body in chunk
+        ]
+        input_file = client.files.create(file=("requests.jsonl", io.BytesIO("\n".join(lines).encode("utf-8"))), purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=BATCH_COMPLETION_WINDOW
+        )
+        store.add_batch(batch.id, [key for key, _ in chunk])
+        batch_ids.append(batch.id)
+        print(f"Submitted batch {batch.id} with {len(chunk)} requests")
+    return batch_ids
+
+def _read_jsonl(client: OpenAI, file_id: Optional[str]) -> List[dict]:
+    if not file_id:
+        return []
+    return [json.loads(line) for line in client.files.content(file_id).text.splitlines() if line.strip()]
+
+def collect_results(client: Optional[OpenAI] = None) -> Dict[str, int]:
+    """
+    Check every open batch once. Responses of finished batches are written to the LLM
+    cache under their request key; requests that failed, or whose batch failed or
+    expired, are requeued for the next submit_pending().
+    """
+    client = client or OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    store = get_store()
+    cache = get_cache()
+    counts = {"open": 0, "completed": 0, "failed": 0}
+    for batch_id in store.open_batches():
+        batch = client.batches.retrieve(batch_id)
+        if batch.status not in TERMINAL_STATUSES:
+            store.set_status(batch_id, batch.status)
+            counts["open"] += 1
+            continue
+        # Expired and cancelled batches can still have partial output
+        resolved = []
+        for record in _read_jsonl(client, batch.output_file_id):
+            response = record.get("response") or {}
+            if response.get("status_code") == 200:
+                cache.set(record["custom_id"], response["body"])
+                resolved.append(record["custom_id"])
+        failed = len(_read_jsonl(client, batch.error_file_id))
+        store.finish_batch(batch_id, batch.status, resolved)
+        counts["completed"] += len(resolved)
+        counts["failed"] += failed
+        print(f"Batch {batch_id} {batch.status}: {len(resolved)} responses cached, {failed} failed")
+    return counts
+
+def wait_for_batches(client: Optional[OpenAI] = None, poll_interval: Optional[float] = None) -> int:
+    """Poll until no submitted batch is open and return the number of responses cached."""
+    poll_interval = BATCH_POLL_INTERVAL if poll_interval is None else poll_interval
+    completed = 0
+    while True:
+        counts = collect_results(client)
+        completed += counts["completed"]
+        if not counts["open"]:
+            return completed
+        print(f"{counts['open']} batches still running, checking again in {poll_interval:.0f}s")
+        time.sleep(poll_interval)
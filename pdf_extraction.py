@@ -0,0 +1,187 @@
+import mmap
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import PyPDF2
+
+# Worker processes available to all extractions together; 0 extracts in the calling process
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", os.cpu_count() or 1))
+# Most of those workers one document may use at once, so concurrent uploads share them
+PDF_WORKERS_PER_DOCUMENT = int(os.environ.get("PDF_WORKERS_PER_DOCUMENT", 4))
+# Pages handed to a worker at a time when a document is split across processes
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", 8))
+# Per-document budget: pages beyond PDF_MAX_PAGES are ignored, and extraction that takes
+# longer than PDF_EXTRACT_TIMEOUT seconds is abandoned
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", 300))
+PDF_EXTRACT_TIMEOUT = float(os.environ.get("PDF_EXTRACT_TIMEOUT", 120))
+# Extra time a worker gets to notice its deadline before its processes are killed
+PDF_KILL_GRACE = 5.0
+
+class WorkerBudget:
+    """
+    Process-wide count of free extraction workers. Each document takes what it can get
+    (at least one, waiting if none are free) and returns them when it finishes, so the
+    total across concurrent extractions stays within PDF_EXTRACT_WORKERS.
+    """
+
+    def __init__(self, workers: int):
+        self._free = workers
+        self._condition = threading.Condition()
+
+    def acquire(self, wanted: int) -> int:
+        with self._condition:
+            while self._free < 1:
+                self._condition.wait()
+            granted = min(max(1, wanted), self._free)
+            self._free -= granted
+            return granted
+
+    def release(self, count: int):
+        with self._condition:
+            self._free += count
+            self._condition.notify_all()
+
+worker_budget = WorkerBudget(PDF_EXTRACT_WORKERS)
+
+# Workers come from a fork server rather than being forked from the caller, which may be
+# running pipeline threads, HTTP sessions and SQLite connections; unlike fork, this also
+# starts processes only as tasks need them
+if "forkserver" in multiprocessing.get_all_start_methods():
+    _mp_context = multiprocessing.get_context("forkserver")
+    # The server imports this module (and PyPDF2) once instead of every worker doing so
+    _mp_context.set_forkserver_preload([__name__])
+else:
+    _mp_context = multiprocessing.get_context("spawn")
+
+@contextmanager
+def open_pdf(pdf_path) -> Iterator[PyPDF2.PdfReader]:
+    # Memory-map the file where possible so page objects are read without copying it
+    with open(pdf_path, 'rb') as file:
+        try:
+            stream = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty files and some special files cannot be mapped
+            stream = file
+        try:
+            yield PyPDF2.PdfReader(stream)
+        finally:
+            if stream is not file:
+                stream.close()
+
+def _count_pages(pdf_path) -> int:
+    with open_pdf(pdf_path) as reader:
+        return len(reader.pages)
+
+def _extract_page_range(pdf_path, start: int, stop: int, deadline: float) -> List[str]:
+    # Runs in a worker process; checks the deadline between pages so a slow document
+    # gives its worker back instead of holding it indefinitely
+    texts = []
+    with open_pdf(pdf_path) as reader:
+        for index in range(start, stop):
+            if time.time() > deadline:
+                raise TimeoutError(f"{pdf_path}: page extraction exceeded its time budget at page {index + 1}")
+            texts.append(reader.pages[index].extract_text() or "")
+    return texts
+
+@contextmanager
+def document_pool(wanted: int) -> Iterator[ProcessPoolExecutor]:
+    """
+    A process pool that serves one document only, with up to `wanted` workers from the
+    shared worker budget. If the document overruns its time budget the pool's processes
+    are killed, which stops that document without touching any other extraction.
+    """
+    workers = worker_budget.acquire(min(wanted, PDF_WORKERS_PER_DOCUMENT))
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context)
+    try:
+        yield pool
+    except BaseException:
+        _kill_pool(pool)
+        raise
+    else:
+        pool.shutdown(wait=True)
+    finally:
+        worker_budget.release(workers)
+
+def _kill_pool(pool: ProcessPoolExecutor):
+    # ProcessPoolExecutor has no public way to stop a running task before Python 3.14
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _page_ranges(page_count: int, workers: int) -> List[Tuple[int, int]]:
+    # Spread a short document over every worker, but keep tasks at most PDF_PAGES_PER_TASK long
+    per_task = max(1, min(PDF_PAGES_PER_TASK, -(-page_count // max(1, workers))))
+    return [(start, min(start + per_task, page_count)) for start in range(0, page_count, per_task)]
+
+def _budgeted_page_count(pdf_path, page_count: int, max_pages: int) -> int:
+    if page_count > max_pages:
+        print(f"Warning: {pdf_path} has {page_count} pages; extracting only the first {max_pages}.")
+    return min(page_count, max_pages)
+
+def _wait_within(futures: Iterable[Future], deadline: float, what: str):
+    _, pending = wait(list(futures), timeout=max(0.0, deadline - time.time()) + PDF_KILL_GRACE)
+    if pending:
+        raise TimeoutError(f"{what} did not finish within its time budget")
+
+def iter_pdf_pages(pdf_path, max_pages: Optional[int] = None, timeout: Optional[float] = None) -> Iterator[str]:
+    """
+    Yield the text of each page of one PDF in order, as soon as the page range holding
+    it is extracted, so callers can start on the first pages while later ones are still
+    being decoded. Page ranges are split across a process pool of the document's own.
+    Only the first `max_pages` pages are read, and a TimeoutError is raised if the
+    document takes longer than `timeout` seconds.
+    """
+    max_pages = PDF_MAX_PAGES if max_pages is None else max_pages
+    timeout = PDF_EXTRACT_TIMEOUT if timeout is None else timeout
+    deadline = time.time() + timeout
+    if PDF_EXTRACT_WORKERS <= 0:
+        with open_pdf(pdf_path) as reader:
+            page_count = _budgeted_page_count(pdf_path, len(reader.pages), max_pages)
+        for start in range(0, page_count, PDF_PAGES_PER_TASK):
+            yield from _extract_page_range(pdf_path, start, min(start + PDF_PAGES_PER_TASK, page_count), deadline)
+        return
+
+    # Even opening the document happens in a worker, so a malformed file cannot stall the caller
+    with document_pool(1) as pool:
+        count_future = pool.submit(_count_pages, pdf_path)
+        _wait_within([count_future], deadline, f"Reading {pdf_path}")
+        page_count = _budgeted_page_count(pdf_path, count_future.result(), max_pages)
+    ranges = _page_ranges(page_count, min(PDF_EXTRACT_WORKERS, PDF_WORKERS_PER_DOCUMENT))
+    if not ranges:
+        return
+
+    # Sized from the page ranges, so a short document holds only the workers it uses.
+    # Closing the generator early kills the document's workers along with its pool.
+    with document_pool(len(ranges)) as pool:
+        futures = [pool.submit(_extract_page_range, pdf_path, start, stop, deadline) for start, stop in ranges]
+        for future in futures:
+            _wait_within([future], deadline, f"Extracting {pdf_path}")
+            yield from future.result()
+
+def extract_pdf_pages(pdf_path, max_pages: Optional[int] = None, timeout: Optional[float] = None) -> List[str]:
+    """The text of every page of one PDF, within the same page and time budget as iter_pdf_pages."""
+    return list(iter_pdf_pages(pdf_path, max_pages, timeout))
+
+def extract_pdf_texts(pdf_paths: Iterable[str], max_pages: Optional[int] = None, timeout: Optional[float] = None) -> Dict[str, Union[str, Exception]]:
+    """
+    Extract many PDFs at once for batch jobs. Documents run concurrently, each in its
+    own pool and with its own page and time budget, so one that overruns is stopped
+    without failing the others. Returns the text of each path, or the exception that
+    stopped its extraction.
+    """
+    pdf_paths = list(dict.fromkeys(pdf_paths))
+
+    def extract(pdf_path):
+        try:
+            return "".join(extract_pdf_pages(pdf_path, max_pages, timeout))
+        except Exception as e:
+            return e
+
+    # The worker budget, not this thread count, bounds the processes in use
+    with ThreadPoolExecutor(max_workers=max(1, min(len(pdf_paths), PDF_EXTRACT_WORKERS))) as executor:
+        return dict(zip(pdf_paths, executor.map(extract, pdf_paths)))
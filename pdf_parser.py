@@ -1,14 +1,34 @@
 import os
+import re
 import json
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import List, Optional
-from pydantic import BaseModel
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from pydantic import BaseModel, Field
 import PyPDF2
 from openai import OpenAI
+from llm_cache import create_chat_completion
+from pdf_extraction import iter_pdf_pages
 
 # Initialize OpenAI client
 client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
+# CVs estimated above this many tokens are parsed in chunks rather than in one prompt
+PARSE_CHUNK_THRESHOLD_TOKENS = int(os.environ.get("PARSE_CHUNK_THRESHOLD_TOKENS", 12000))
+# Token budget per chunk and number of chunks extracted at once
+PARSE_CHUNK_TOKENS = int(os.environ.get("PARSE_CHUNK_TOKENS", 6000))
+PARSE_MAX_WORKERS = int(os.environ.get("PARSE_MAX_WORKERS", 4))
+
+SECTION_KEYWORDS = (
+    "education", "academic background", "award", "honor", "honour", "prize", "fellowship", "grant",
+    "publication", "journal", "conference", "paper", "book", "patent", "license", "copyright",
+    "membership", "professional activit", "service", "review", "committee", "editorial",
+    "employment", "experience", "appointment", "position", "career", "teaching", "student",
+    "media", "press", "invited talk", "keynote", "talk", "contribution", "research interest", "skill"
+)
+
 class Education(BaseModel):
     school: str
     year: int
@@ -75,16 +95,104 @@ class CVData(BaseModel):
 class ResearchFields(BaseModel):
     fields: List[str]
 
+class CVExtraction(CVData):
+    # CVData and ResearchFields in one schema, so one request covers both
+    research_fields: List[str] = Field(description="The person's main research field(s), up to 3 keywords")
+
+# Research fields kept when merging per-chunk predictions
+MAX_RESEARCH_FIELDS = 3
+
 def extract_text_from_pdf(pdf_path):
-    with open(pdf_path, 'rb') as file:
-        reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
-    return text
-
-def parse_cv(cv_text):
-    completion = client.chat.completions.create(
+    # Page ranges are decoded across the process pool, within the per-document page and time budget
+    return "".join(iter_pdf_pages(pdf_path))
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English prose
+    return len(text) // 4 + 1
+
+def is_section_heading(line: str) -> bool:
+    stripped = line.strip().rstrip(':')
+    if not stripped or len(stripped) > 60 or stripped.endswith('.'):
+        return False
+    lowered = stripped.lower()
+    if any(lowered.startswith(keyword) or lowered.endswith(keyword) or lowered.endswith(keyword + "s") for keyword in SECTION_KEYWORDS):
+        return True
+    # Short all-caps lines are headings in most CV templates
+    letters = [c for c in stripped if c.isalpha()]
+    return len(letters) >= 4 and all(c.isupper() for c in letters)
+
+def _split_section(heading: Optional[str], lines: List[str], max_tokens: int) -> Iterator[str]:
+    # Split an oversized section on line boundaries, repeating its heading for context
+    prefix = f"{heading} (continued)\n" if heading else ""
+    current = []
+    current_tokens = 0
+    for line in lines:
+        line_tokens = estimate_tokens(line)
+        if current and current_tokens + line_tokens > max_tokens:
+            yield "\n".join(current)
+            current = [prefix.rstrip("\n")] if prefix else []
+            current_tokens = estimate_tokens(prefix)
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        yield "\n".join(current)
+
+def iter_cv_chunks(text_pieces: Iterable[str], max_tokens: int) -> Iterator[str]:
+    """
+    Split CV text into chunks of at most `max_tokens` (estimated), breaking at detected
+    section headings where possible. `text_pieces` may be any iterable of text (e.g.
+    pages as they are decoded); chunks are yielded as soon as they are complete.
+    """
+    chunk = []
+    chunk_tokens = 0
+    section_heading = None
+    section = []
+
+    def flush_section():
+        nonlocal chunk, chunk_tokens
+        if not section:
+            return
+        text = "\n".join(section)
+        tokens = estimate_tokens(text)
+        if chunk and chunk_tokens + tokens > max_tokens:
+            yield "\n".join(chunk)
+            chunk = []
+            chunk_tokens = 0
+        if tokens > max_tokens:
+            pieces = list(_split_section(section_heading, section, max_tokens))
+            yield from pieces[:-1]
+            text = pieces[-1]
+            tokens = estimate_tokens(text)
+        chunk.append(text)
+        chunk_tokens += tokens
+
+    partial = ""
+    for piece in text_pieces:
+        lines = (partial + piece).split("\n")
+        # The last line may continue in the next piece
+        partial = lines.pop()
+        for line in lines:
+            if is_section_heading(line) and section:
+                yield from flush_section()
+                section = []
+                section_heading = line.strip()
+            elif not section and is_section_heading(line):
+                section_heading = line.strip()
+            section.append(line)
+    if partial:
+        section.append(partial)
+    yield from flush_section()
+    if chunk:
+        yield "\n".join(chunk)
+
+def parse_cv(cv_text, chunked=None):
+    if chunked is None:
+        chunked = estimate_tokens(cv_text) > PARSE_CHUNK_THRESHOLD_TOKENS
+    if chunked:
+        return parse_cv_chunked(cv_text)
+
+    completion = create_chat_completion(
+        client,
         model="gpt-4o",
         messages=[
             {
@@ -111,8 +219,176 @@ def parse_cv(cv_text):
 
     return json.loads(completion.choices[0].message.tool_calls[0].function.arguments)
 
+def parse_cv_fragment(cv_chunk, with_fields=False):
+    fields_request = ". Also predict the person's main research field(s) in up to 3 keywords based on this excerpt" if with_fields else ""
+    completion = create_chat_completion(
+        client,
+        model="gpt-4o",
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a CV parsing expert. Extract the requested information accurately from the given CV text. Leave fields empty if the information is not available."
+            },
+            {
+                "role": "user",
+                "content": f"The following is an excerpt of a longer CV. Extract key information present in this excerpt only, including additional fields such as patents, licenses, copyrights, h-index, major awards, association memberships, conference activities, major contributions, media coverage, employment history, and highest salary. Leave fields empty if not available in the excerpt{fields_request}:\n\n{cv_chunk}"
+            },
+        ],
+        tools=[
+            {
+                "type": "function",
+                "function": {
+                    "name": "extract_cv_data",
+                    "description": "Extracts structured data from a CV",
+                    "parameters": (CVExtraction if with_fields else CVData).model_json_schema()
+                }
+            }
+        ],
+        tool_choice={"type": "function", "function": {"name": "extract_cv_data"}}
+    )
+
+    return json.loads(completion.choices[0].message.tool_calls[0].function.arguments)
+
+def _normalize_text(value: Any) -> str:
+    return re.sub(r'[^a-z0-9]+', ' ', str(value or '').lower()).strip()
+
+# Identity of a record in each list field, used to de-duplicate across chunks
+RECORD_KEYS: Dict[str, Callable[[Any], Any]] = {
+    "education": lambda r: (_normalize_text(r.get("school")), r.get("year"), _normalize_text(r.get("degree"))),
+    "awards": lambda r: (_normalize_text(r.get("award")), r.get("year")),
+    "major_awards": lambda r: (_normalize_text(r.get("award")), r.get("year")),
+    "publications": lambda r: _normalize_text(r.get("title")),
+    "patents": lambda r: _normalize_text(r.get("number") or r.get("title")),
+    "licenses": lambda r: (_normalize_text(r.get("name")), r.get("year")),
+    "copyrights": lambda r: _normalize_text(r.get("number") or r.get("title")),
+    "conference_activities": lambda r: (_normalize_text(r.get("activity_type")), _normalize_text(r.get("conference_name")), r.get("year"), _normalize_text(r.get("details"))),
+    "employment_history": lambda r: (_normalize_text(r.get("organization")), _normalize_text(r.get("role")), r.get("year_start")),
+}
+
+def merge_cv_fragments(fragments: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge per-chunk CVData fragments in chunk order. Duplicate records keep their first
+    occurrence, with empty values filled in from later duplicates.
+    """
+    merged: Dict[str, Any] = {}
+    for field_name, field in CVData.model_fields.items():
+        values = [fragment.get(field_name) for fragment in fragments]
+        if field_name in ("h_index", "highest_salary"):
+            present = [v for v in values if v is not None]
+            merged[field_name] = max(present) if present else None
+        elif field_name in ("name", "email"):
+            merged[field_name] = next((v for v in values if v), "")
+        else:
+            key_fn = RECORD_KEYS.get(field_name, _normalize_text)
+            records = {}
+            for value in values:
+                for record in value or []:
+                    key = key_fn(record)
+                    if key not in records:
+                        records[key] = dict(record) if isinstance(record, dict) else record
+                    elif isinstance(record, dict):
+                        existing = records[key]
+                        for k, v in record.items():
+                            if existing.get(k) in (None, "", []) and v not in (None, "", []):
+                                existing[k] = v
+            merged[field_name] = list(records.values())
+    return merged
+
+def extract_fragments(cv_text: Union[str, Iterable[str]], max_chunk_tokens=None, max_workers=None, with_fields=False) -> List[Dict[str, Any]]:
+    pieces = [cv_text] if isinstance(cv_text, str) else cv_text
+    with ThreadPoolExecutor(max_workers=max(1, max_workers or PARSE_MAX_WORKERS)) as executor:
+        futures = [
+            executor.submit(parse_cv_fragment, chunk, with_fields)
+            for chunk in iter_cv_chunks(pieces, max_chunk_tokens or PARSE_CHUNK_TOKENS)
+        ]
+        fragments = [future.result() for future in futures]
+    print(f"Parsed CV in {len(fragments)} chunks")
+    return fragments
+
+def parse_cv_chunked(cv_text: Union[str, Iterable[str]], max_chunk_tokens=None, max_workers=None):
+    """
+    Parse a long CV by extracting each section-aligned chunk in parallel and merging
+    the fragments. Chunks are dispatched as soon as `iter_cv_chunks` produces them.
+    """
+    return merge_cv_fragments(extract_fragments(cv_text, max_chunk_tokens, max_workers))
+
+def merge_research_fields(fragments: List[Dict[str, Any]]) -> List[str]:
+    # Fields predicted by the most chunks win; ties keep the order they first appeared in
+    votes = Counter()
+    first_seen = {}
+    for fragment in fragments:
+        for field in fragment.get("research_fields") or []:
+            key = _normalize_text(field)
+            if key:
+                votes[key] += 1
+                first_seen.setdefault(key, (len(first_seen), field))
+    ranked = sorted(votes, key=lambda key: (-votes[key], first_seen[key][0]))
+    return [first_seen[key][1] for key in ranked[:MAX_RESEARCH_FIELDS]]
+
+def parse_cv_with_fields(cv_text, chunked=None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Return (CVData, ResearchFields) for a CV from a single pass over its text, instead of
+    sending the whole text to both parse_cv and predict_research_field. Long CVs are
+    chunked as in parse_cv, and the per-chunk field predictions are merged by vote.
+    """
+    if chunked is None:
+        chunked = estimate_tokens(cv_text) > PARSE_CHUNK_THRESHOLD_TOKENS
+    if chunked:
+        fragments = extract_fragments(cv_text, with_fields=True)
+        return merge_cv_fragments(fragments), {"fields": merge_research_fields(fragments)}
+
+    completion = create_chat_completion(
+        client,
+        model="gpt-4o",
+        messages=[
+            {
+                "role": "system",
+                "content": "You are a CV parsing expert and an expert in academic research fields. Extract the requested information accurately from the given CV text. Leave fields empty if the information is not available."
+            },
+            {
+                "role": "user",
+                "content": f"Parse the following CV and extract key information, including additional fields such as patents, licenses, copyrights, h-index, major awards, association memberships, conference activities, major contributions, media coverage, employment history, and highest salary. Leave fields empty if not available. Also predict the person's main research field(s) in up to 3 keywords:\n\n{cv_text}"
+            },
+        ],
+        tools=[
+            {
+                "type": "function",
+                "function": {
+                    "name": "extract_cv_data",
+                    "description": "Extracts structured data and research fields from a CV",
+                    "parameters": CVExtraction.model_json_schema()
+                }
+            }
+        ],
+        tool_choice={"type": "function", "function": {"name": "extract_cv_data"}}
+    )
+
+    extracted = json.loads(completion.choices[0].message.tool_calls[0].function.arguments)
+    fields = extracted.pop("research_fields", None) or []
+    return extracted, {"fields": fields[:MAX_RESEARCH_FIELDS]}
+
+def parse_pages_with_fields(pages: Iterable[str]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    parse_cv_with_fields over a stream of page texts, e.g. from iter_pdf_pages. Short CVs
+    are parsed in one request once every page has arrived. As soon as the text read so
+    far passes PARSE_CHUNK_THRESHOLD_TOKENS, chunk extraction starts on it while later
+    pages are still being decoded. Requests are the same as for the joined text.
+    """
+    pages = iter(pages)
+    head = []
+    chars = 0
+    for page in pages:
+        head.append(page)
+        chars += len(page)
+        # estimate_tokens of the text read so far, without joining it on every page
+        if chars // 4 + 1 > PARSE_CHUNK_THRESHOLD_TOKENS:
+            fragments = extract_fragments(itertools.chain(head, pages), with_fields=True)
+            return merge_cv_fragments(fragments), {"fields": merge_research_fields(fragments)}
+    return parse_cv_with_fields("".join(head), chunked=False)
+
 def predict_research_field(cv_text):
-    completion = client.chat.completions.create(
+    completion = create_chat_completion(
+        client,
         model="gpt-4o",
         messages=[
             {
@@ -149,8 +425,7 @@ def main(pdf_path):
         print(f"Error: Unable to read the PDF file '{pdf_path}'. Make sure it's a valid PDF.")
         return
 
-    parsed_cv = parse_cv(cv_text)
-    research_fields = predict_research_field(cv_text)
+    parsed_cv, research_fields = parse_cv_with_fields(cv_text)
 
     output = {
         **parsed_cv,
@@ -0,0 +1,177 @@
+import os
+import re
+import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Label publications from their citation percentile and venue tier, sending only the
+# ambiguous ones to the LLM; set PUBLICATION_RULES=0 to label everything with the LLM
+PUBLICATION_RULES = os.environ.get("PUBLICATION_RULES", "1") == "1"
+# Bump when the tables or thresholds below change so checkpointed labels are redone
+PUBLICATION_RULES_VERSION = 2
+
+# Citation percentile (within the field, adjusted for the paper's age) at or above which a
+# paper is extraordinary, and below which a paper outside a ranked venue is not
+EXTRAORDINARY_PERCENTILE = float(os.environ.get("EXTRAORDINARY_PERCENTILE", 95))
+ORDINARY_PERCENTILE = float(os.environ.get("ORDINARY_PERCENTILE", 75))
+# Papers younger than this (in years) have not had time to collect citations, so a low
+# count alone does not make them ordinary
+MIN_CITATION_AGE = int(os.environ.get("MIN_CITATION_AGE", 2))
+
+# Approximate citation counts of a ten-year-old paper at these percentiles of its field
+PERCENTILES = [0, 50, 75, 90, 95, 99]
+CITATION_PERCENTILES = {
+    "computer_science": [0, 10, 30, 90, 180, 700],
+    "biomedicine": [0, 20, 50, 120, 220, 700],
+    "physics": [0, 12, 35, 90, 160, 500],
+    "chemistry": [0, 15, 40, 100, 170, 500],
+    "mathematics": [0, 5, 12, 30, 55, 150],
+    "engineering": [0, 8, 22, 60, 110, 350],
+    "social_sciences": [0, 8, 25, 70, 130, 450],
+    "default": [0, 10, 30, 90, 160, 500],
+}
+
+# Share of its ten-year citations a paper has collected at a given age
+CITATION_AGES = [0, 1, 2, 3, 5, 10, 20, 30]
+CITATION_ACCRUAL = [0.05, 0.2, 0.35, 0.5, 0.7, 1.0, 1.3, 1.45]
+
+# Keywords mapping free-text research fields to a discipline of CITATION_PERCENTILES,
+# checked in order
+DISCIPLINE_KEYWORDS = [
+    ("computer_science", ("comput", "machine learning", "deep learning", "artificial intelligence", "neural network",
+                          "vision", "language processing", "robot", "software", "data", "pattern recognition",
+                          "information", "algorithm", "security")),
+    ("biomedicine", ("bio", "medic", "neuro", "genet", "health", "clinical", "cancer", "immun", "pharma", "molecular")),
+    ("physics", ("physic", "astro", "quantum", "optic", "cosmolog")),
+    ("chemistry", ("chem", "material")),
+    ("mathematics", ("math", "statistic", "probability", "geometry", "algebra")),
+    ("engineering", ("engineer", "electric", "mechanic", "signal", "control", "energy")),
+    ("social_sciences", ("econom", "social", "psycholog", "political", "education", "management", "finance")),
+]
+
+# Curated venue tiers: 1 is a field-leading journal or conference, 2 a strong one.
+# Keys are lowercase venue names or acronyms; they are matched through normalize_venue,
+# so proceedings prefixes, edition numbers and years need not be listed.
+VENUE_TIERS = {
+    # Multidisciplinary and life sciences
+    "nature": 1, "science": 1, "cell": 1, "the lancet": 1, "lancet": 1, "new england journal of medicine": 1,
+    "jama": 1, "proceedings of the national academy of sciences": 1,
+    "proceedings of the national academy of sciences of the united states of america": 1, "pnas": 1, "nature communications": 2,
+    "science advances": 2, "elife": 2, "plos biology": 2, "neuron": 1, "nature neuroscience": 1,
+    # Physics, chemistry and mathematics
+    "physical review letters": 1, "physical review x": 1, "journal of the american chemical society": 1,
+    "angewandte chemie": 1, "annals of mathematics": 1, "inventiones mathematicae": 1, "physical review b": 2,
+    # Machine learning and AI
+    "neural information processing systems": 1, "neurips": 1, "nips": 1,
+    "international conference on machine learning": 1, "icml": 1,
+    "international conference on learning representations": 1, "iclr": 1,
+    "journal of machine learning research": 1, "jmlr": 1,
+    "ieee transactions on pattern analysis and machine intelligence": 1, "tpami": 1,
+    "aaai conference on artificial intelligence": 2, "aaai": 2,
+    "international joint conference on artificial intelligence": 2, "ijcai": 2,
+    "neural computation": 2, "neural networks": 2, "ieee transactions on neural networks and learning systems": 2,
+    "artificial intelligence": 2, "conference on uncertainty in artificial intelligence": 2, "uai": 2,
+    "international conference on artificial intelligence and statistics": 2, "aistats": 2,
+    # Vision, language and speech
+    "computer vision and pattern recognition": 1, "ieee conference on computer vision and pattern recognition": 1,
+    "ieee cvf conference on computer vision and pattern recognition": 1, "cvpr": 1, "ieee international conference on computer vision": 1,
+    "international conference on computer vision": 1, "iccv": 1, "european conference on computer vision": 1,
+    "eccv": 1, "international journal of computer vision": 1, "ijcv": 1,
+    "annual meeting of the association for computational linguistics": 1,
+    "meeting of the association for computational linguistics": 1, "acl": 1,
+    "conference on empirical methods in natural language processing": 1, "emnlp": 1,
+    "north american chapter of the association for computational linguistics": 2, "naacl": 2,
+    "ieee international conference on acoustics speech and signal processing": 2, "icassp": 2,
+    "interspeech": 2, "proceedings of the ieee": 1,
+    # Systems, theory, data and HCI
+    "knowledge discovery and data mining": 1, "kdd": 1, "the web conference": 1, "www": 1,
+    "international acm sigir conference on research and development in information retrieval": 1, "sigir": 1,
+    "conference on human factors in computing systems": 1, "chi": 1, "sigcomm": 1, "osdi": 1, "sosp": 1,
+    "nsdi": 1, "symposium on the theory of computing": 1, "stoc": 1, "foundations of computer science": 1,
+    "focs": 1, "symposium on discrete algorithms": 2, "soda": 2, "international conference on software engineering": 1,
+    "icse": 1, "pldi": 1, "popl": 1, "siggraph": 1, "acm transactions on graphics": 1,
+    "ieee symposium on security and privacy": 1, "usenix security symposium": 1,
+    "ieee international conference on robotics and automation": 2, "icra": 2,
+    "ieee rsj international conference on intelligent robots and systems": 2, "iros": 2,
+    "robotics science and systems": 2, "rss": 2, "science robotics": 1,
+}
+
+_VENUE_NOISE = [
+    # "Proceedings of the 58th Annual ..." but not names like "Proceedings of the IEEE"
+    re.compile(r"^(proceedings|advances) (of|in) (the (?=\S+ \S+)|(?!the )(?=\S+ \S+))"),
+    re.compile(r"\b\d+(st|nd|rd|th)\b|\b(annual|the)\b|\d+"),
+    re.compile(r"\bof (the )?united states of america$"),
+]
+
+def normalize_venue(venue: str) -> str:
+    """
+    Lowercase a venue name and drop punctuation, proceedings prefixes, edition
+    numbers, years and a trailing "of the United States of America".
+    """
+    name = " ".join(re.sub(r"[^a-z0-9 ]", " ", (venue or "").lower()).split())
+    for pattern in _VENUE_NOISE:
+        name = " ".join(pattern.sub(" ", name).split())
+    return name
+
+# VENUE_TIERS keyed by normalized name
+_VENUE_INDEX = {normalize_venue(name): tier for name, tier in VENUE_TIERS.items()}
+
+def venue_tier(venue: str) -> Optional[int]:
+    """Tier of a venue by its normalized name, or of the acronym in parentheses after it."""
+    tier = _VENUE_INDEX.get(normalize_venue(venue))
+    if tier is None:
+        acronym = re.search(r"\(([A-Za-z]+)\)", venue or "")
+        tier = _VENUE_INDEX.get(acronym.group(1).lower()) if acronym else None
+    return tier
+
+def field_discipline(fields: Optional[List[str]]) -> str:
+    """The discipline of the first research field a keyword matches, or "default"."""
+    for field in fields or []:
+        lowered = field.lower()
+        for discipline, keywords in DISCIPLINE_KEYWORDS:
+            if any(keyword in lowered for keyword in keywords):
+                return discipline
+    return "default"
+
+def score_publications(publications: List[Dict[str, Any]], fields: Optional[List[str]] = None,
+                       current_year: Optional[int] = None) -> pd.DataFrame:
+    """
+    Score every publication at once: its citation percentile within the researcher's
+    discipline (after adjusting for the paper's age), its venue tier, and the rule label
+    ("yes", "no", or None when the LLM has to decide).
+    """
+    current_year = current_year or datetime.date.today().year
+    frame = pd.DataFrame({
+        "citation_count": pd.to_numeric(pd.Series([pub.get("citation_count") for pub in publications], dtype=object), errors="coerce"),
+        "year": pd.to_numeric(pd.Series([pub.get("year") for pub in publications], dtype=object), errors="coerce"),
+        "venue": pd.Series([pub.get("venue_name") or pub.get("venue") or "" for pub in publications], dtype=object),
+    })
+    if frame.empty:
+        return frame.assign(age=[], percentile=[], venue_tier=[], label=[])
+
+    frame["age"] = (current_year - frame["year"]).clip(lower=0)
+    accrual = np.interp(frame["age"].fillna(0).to_numpy(dtype=float), CITATION_AGES, CITATION_ACCRUAL)
+    # Interpolate on a log scale, where citation distributions are roughly even
+    anchors = np.log1p(np.asarray(CITATION_PERCENTILES[field_discipline(fields)], dtype=float))
+    normalized = np.log1p(frame["citation_count"].fillna(0).to_numpy(dtype=float) / accrual)
+    frame["percentile"] = np.interp(normalized, anchors, PERCENTILES)
+    frame.loc[frame["citation_count"].isna() | frame["year"].isna(), "percentile"] = np.nan
+    frame["venue_tier"] = pd.to_numeric(frame["venue"].map(venue_tier), errors="coerce")
+
+    percentile = frame["percentile"]
+    highly_cited = percentile >= EXTRAORDINARY_PERCENTILE
+    top_venue = frame["venue_tier"] == 1
+    # Rarely cited papers outside ranked venues are ordinary once they are old enough
+    # for their count to mean something
+    ordinary = (percentile < ORDINARY_PERCENTILE) & frame["venue_tier"].isna() & (frame["age"] >= MIN_CITATION_AGE)
+    labels = pd.Series(np.select([highly_cited | top_venue, ordinary], ["yes", "no"], default=""), index=frame.index)
+    frame["label"] = labels.where(labels != "", None)
+    return frame
+
+def rule_labels(publications: List[Dict[str, Any]], fields: Optional[List[str]] = None) -> List[Optional[str]]:
+    """Rule label for each publication, or None where the LLM should decide."""
+    if not publications:
+        return []
+    return score_publications(publications, fields)["label"].tolist()
@@ -0,0 +1,45 @@
+import threading
+import time
+
+class TokenBucket:
+    """
+    Thread-safe token-bucket rate limiter.
+
+    `rate` tokens are added per second up to `capacity`; acquire() blocks until a
+    token is available. pause() lets a caller that received a 429 hold back every
+    other thread sharing the bucket until the server's Retry-After has passed.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens: float = 1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                else:
+                    self._refill(now)
+                    if self.tokens >= tokens:
+                        self.tokens -= tokens
+                        return
+                    delay = (tokens - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def pause(self, seconds: float):
+        with self.lock:
+            now = time.monotonic()
+            self.paused_until = max(self.paused_until, now + seconds)
+            # Allow a single request once the pause ends, not a burst of saved-up tokens
+            self.tokens = 1
+            self.updated = max(self.updated, self.paused_until)
@@ -1,91 +1,322 @@
+import os
+import re
+import threading
+from time import sleep
+from typing import Any, Dict, List, Optional
+
 import requests
+from requests.adapters import HTTPAdapter
 from fuzzywuzzy import fuzz
-import re
-import os
 
-def search_semantic_scholar(query, author_name):
-    base_url = "https://api.semanticscholar.org/graph/v1"
+from cache import MISSING, SQLiteCache, make_key
+from rate_limit import TokenBucket
+
+BASE_URL = "https://api.semanticscholar.org/graph/v1"
+PAPER_FIELDS = "title,externalIds,year,citationCount,authors,venue,publicationVenue"
+# Author paper listings don't need the author list of every paper
+AUTHOR_PAPER_FIELDS = "title,externalIds,year,citationCount,venue,publicationVenue"
+# Limits of the /paper/batch and /author/{id}/papers endpoints
+BATCH_SIZE = 500
+AUTHOR_PAPERS_PAGE_SIZE = 1000
+
+# Tune to the quota of the S2 API key (the default key tier allows 1 request per second)
+S2_REQUESTS_PER_SECOND = float(os.environ.get("S2_REQUESTS_PER_SECOND", 1))
+S2_BURST = float(os.environ.get("S2_BURST", 1))
+# Number of publication lookups allowed in flight at once
+S2_MAX_CONCURRENCY = int(os.environ.get("S2_MAX_CONCURRENCY", 4))
+
+# On-disk lookup cache; set S2_CACHE_PATH to an empty string to disable it.
+# The TTL bounds how stale citation counts can get.
+S2_CACHE_PATH = os.environ.get("S2_CACHE_PATH", os.path.join(".cache", "semantic_scholar.sqlite"))
+S2_CACHE_TTL = float(os.environ.get("S2_CACHE_TTL", 7 * 24 * 3600))
+S2_CACHE_MAX_ENTRIES = int(os.environ.get("S2_CACHE_MAX_ENTRIES", 100000))
+
+# Function to perform fuzzy matching on strings
+def fuzzy_match(s1, s2, threshold=80):
+    return fuzz.ratio(s1.lower(), s2.lower()) >= threshold
+
+# Function to validate author name
+def validate_author(api_author, given_author):
+    api_name = api_author.lower()
+    given_name = given_author.lower()
     
-    # Load API key from environment variable
-    api_key = os.environ.get("S2_API_KEY")
-    if not api_key:
-        print("Warning: S2_API_KEY not found in environment variables. Proceeding without API key.")
+    # Check for exact match
+    if api_name == given_name:
+        return True
     
-    # Function to perform fuzzy matching on strings
-    def fuzzy_match(s1, s2, threshold=80):
-        return fuzz.ratio(s1.lower(), s2.lower()) >= threshold
-
-    # Function to validate author name
-    def validate_author(api_author, given_author):
-        api_name = api_author.lower()
-        given_name = given_author.lower()
-        
-        # Check for exact match
-        if api_name == given_name:
+    # Check for first initial + last name
+    initials_last = re.match(r'^(\w)\w* (\w+)$', given_name)
+    if initials_last:
+        pattern = f'^{initials_last.group(1)}\\w* {initials_last.group(2)}$'
+        if re.match(pattern, api_name, re.IGNORECASE):
             return True
-        
-        # Check for first initial + last name
-        initials_last = re.match(r'^(\w)\w* (\w+)$', given_name)
-        if initials_last:
-            pattern = f'^{initials_last.group(1)}\\w* {initials_last.group(2)}$'
-            if re.match(pattern, api_name, re.IGNORECASE):
-                return True
-        
-        # Fuzzy match for cases with middle names or slight variations
-        return fuzzy_match(api_name, given_name, threshold=85)
-
-    # Use the search endpoint for all queries
-    search_url = f"{base_url}/paper/search"
-    params = {
-        "query": query,
-        "fields": "title,externalIds,year,citationCount,authors,venue,publicationVenue",
-        "limit": 10
+    
+    # Fuzzy match for cases with middle names or slight variations
+    return fuzzy_match(api_name, given_name, threshold=85)
+
+def normalize_doi(doi: Optional[str]) -> Optional[str]:
+    if not doi:
+        return None
+    doi = doi.strip().lower()
+    doi = re.sub(r'^(https?://(dx\.)?doi\.org/|doi:\s*)', '', doi)
+    return doi or None
+
+def normalize_title(title: str) -> str:
+    return re.sub(r'[^a-z0-9]+', ' ', title.lower()).strip()
+
+def normalize_query(query: str) -> str:
+    # Queries are either a DOI or a title
+    if re.match(r'^(https?://(dx\.)?doi\.org/|doi:\s*)?10\.', query.strip(), re.IGNORECASE):
+        return normalize_doi(query)
+    return normalize_title(query)
+
+def format_paper(paper: Dict[str, Any]) -> Dict[str, Any]:
+    venue_info = paper.get('publicationVenue') or {}
+    return {
+        "title": paper['title'],
+        "doi": (paper.get('externalIds') or {}).get('DOI'),
+        "year": paper.get('year'),
+        "citation_count": paper.get('citationCount'),
+        "venue": paper.get('venue'),
+        "venue_id": venue_info.get('id'),
+        "venue_name": venue_info.get('name'),
+        "venue_type": venue_info.get('type'),
+        "venue_url": venue_info.get('url')
     }
 
-    # Prepare headers with API key if available
-    headers = {"x-api-key": api_key} if api_key else {}
+class SemanticScholarClient:
+    """
+    Shared Semantic Scholar Graph API client.
 
-    response = requests.get(search_url, params=params, headers=headers)
-    
-    if response.status_code != 200:
-        print(f"Error: API request failed with status code {response.status_code}")
-        print(f"Response: {response.text}")
+    Requests go through one keep-alive session whose connection pool is sized for
+    the lookup concurrency, and through a token bucket tuned to the API key quota.
+    429 and 5xx responses are retried with backoff, honouring Retry-After.
+    Successful lookups are stored in `cache` (if given) so repeat queries stay local;
+    failed requests are never cached.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, requests_per_second: float = S2_REQUESTS_PER_SECOND,
+                 burst: float = S2_BURST, pool_size: int = S2_MAX_CONCURRENCY, max_retries: int = 5,
+                 timeout: float = 30, cache: Optional[SQLiteCache] = None):
+        # Load API key from environment variable
+        api_key = api_key or os.environ.get("S2_API_KEY")
+        if not api_key:
+            print("Warning: S2_API_KEY not found in environment variables. Proceeding without API key.")
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount("https://", adapter)
+        if api_key:
+            self.session.headers["x-api-key"] = api_key
+
+        self.rate_limiter = TokenBucket(requests_per_second, burst)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.cache = cache
+
+    def _cache_get(self, key: str) -> Any:
+        return self.cache.get(key) if self.cache is not None else MISSING
+
+    def _cache_set(self, key: str, value: Any):
+        if self.cache is not None:
+            self.cache.set(key, value)
+
+    def _retry_delay(self, response: Optional[requests.Response], attempt: int) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.strip().isdigit():
+                return float(retry_after)
+        return min(60.0, 2 ** attempt)
+
+    def request(self, method: str, path: str, **kwargs) -> Optional[Any]:
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.request(method, f"{BASE_URL}{path}", timeout=self.timeout, **kwargs)
+            except requests.RequestException as e:
+                print(f"Error: API request failed: {str(e)}")
+                sleep(self._retry_delay(None, attempt))
+                continue
+
+            if response.status_code == 429 or response.status_code >= 500:
+                delay = self._retry_delay(response, attempt)
+                print(f"Warning: API returned {response.status_code}, retrying in {delay:.1f}s")
+                if response.status_code == 429:
+                    # Hold back every thread sharing this client, not just this one
+                    self.rate_limiter.pause(delay)
+                else:
+                    sleep(delay)
+                continue
+
+            if response.status_code != 200:
+                print(f"Error: API request failed with status code {response.status_code}")
+                print(f"Response: {response.text}")
+                return None
+
+            return response.json()
+
+        print(f"Error: API request to {path} failed after {self.max_retries + 1} attempts")
         return None
 
-    data = response.json()
+    def search_paper(self, query: str, author_name: str, validate_authors: bool = True) -> Optional[Dict[str, Any]]:
+        cache_key = make_key("search", normalize_query(query), author_name.strip().lower(), validate_authors)
+        cached = self._cache_get(cache_key)
+        if cached is not MISSING:
+            return cached
+
+        # Use the search endpoint for all queries
+        params = {
+            "query": query,
+            "fields": PAPER_FIELDS,
+            "limit": 10
+        }
+
+        data = self.request("GET", "/paper/search", params=params)
+        if data is None:
+            return None
+
+        if 'data' not in data:
+            print(f"Unexpected data structure: {data}")
+            return None
+
+        result = self._match_search_results(data['data'], query, author_name, validate_authors)
+        # "Not found" answers are cached too, so unknown titles are not re-queried
+        self._cache_set(cache_key, result)
+        return result
+
+    def _match_search_results(self, papers, query, author_name, validate_authors):
+        for paper in papers:
+            if 'title' not in paper:
+                print(f"Warning: 'title' not found in paper data: {paper}")
+                continue
+
+            # Check if the paper matches the query (either by title or DOI)
+            doi = (paper.get('externalIds') or {}).get('DOI') or ''
+            if fuzzy_match(paper['title'], query) or query.lower() in doi.lower():
+                for author in paper.get('authors', []):
+                    if 'name' not in author:
+                        print(f"Warning: 'name' not found in author data: {author}")
+                        continue
+                    if not validate_authors or validate_author(author['name'], author_name):
+                        return format_paper(paper)
 
-    if 'data' not in data:
-        print(f"Unexpected data structure: {data}")
         return None
 
-    papers = data['data']
-
-    for paper in papers:
-        if 'title' not in paper:
-            print(f"Warning: 'title' not found in paper data: {paper}")
-            continue
-
-        # Check if the paper matches the query (either by title or DOI)
-        if fuzzy_match(paper['title'], query) or query.lower() in paper.get('externalIds', {}).get('DOI', '').lower():
-            for author in paper.get('authors', []):
-                if 'name' not in author:
-                    print(f"Warning: 'name' not found in author data: {author}")
-                    continue
-                if validate_author(author['name'], author_name):
-                    venue_info = paper.get('publicationVenue', {})
-                    return {
-                        "title": paper['title'],
-                        "doi": paper.get('externalIds', {}).get('DOI'),
-                        "year": paper.get('year'),
-                        "citation_count": paper.get('citationCount'),
-                        "venue": paper.get('venue'),
-                        "venue_id": venue_info.get('id'),
-                        "venue_name": venue_info.get('name'),
-                        "venue_type": venue_info.get('type'),
-                        "venue_url": venue_info.get('url')
-                    }
-
-    return None
+    def get_papers_batch(self, paper_ids: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Fetch papers by id (e.g. "DOI:10.1038/nature14539"), BATCH_SIZE ids per request."""
+        papers = {}
+        uncached = []
+        for paper_id in dict.fromkeys(paper_ids):
+            cached = self._cache_get(make_key("paper", paper_id.lower()))
+            if cached is MISSING:
+                uncached.append(paper_id)
+            else:
+                papers[paper_id] = cached
+
+        for i in range(0, len(uncached), BATCH_SIZE):
+            chunk = uncached[i:i + BATCH_SIZE]
+            data = self.request("POST", "/paper/batch", params={"fields": PAPER_FIELDS}, json={"ids": chunk})
+            if not isinstance(data, list):
+                continue
+            # Unknown ids come back as null in their slot
+            for paper_id, paper in zip(chunk, data):
+                papers[paper_id] = paper
+                self._cache_set(make_key("paper", paper_id.lower()), paper)
+        return [papers.get(paper_id) for paper_id in paper_ids]
+
+    def find_author_id(self, author_name: str) -> Optional[str]:
+        cache_key = make_key("author", author_name.strip().lower())
+        cached = self._cache_get(cache_key)
+        if cached is not MISSING:
+            return cached
+
+        data = self.request("GET", "/author/search", params={"query": author_name, "fields": "name,paperCount", "limit": 10})
+        if not data or 'data' not in data:
+            return None
+        candidates = [a for a in data['data'] if validate_author(a.get('name', ''), author_name)]
+        # Homonyms are common; the most prolific match is usually the CV owner
+        author_id = max(candidates, key=lambda a: a.get('paperCount') or 0)['authorId'] if candidates else None
+        self._cache_set(cache_key, author_id)
+        return author_id
+
+    def get_author_papers(self, author_id: str) -> List[Dict[str, Any]]:
+        cache_key = make_key("author_papers", author_id)
+        cached = self._cache_get(cache_key)
+        if cached is not MISSING:
+            return cached
+
+        papers = []
+        offset = 0
+        while offset is not None:
+            params = {"fields": AUTHOR_PAPER_FIELDS, "limit": AUTHOR_PAPERS_PAGE_SIZE, "offset": offset}
+            data = self.request("GET", f"/author/{author_id}/papers", params=params)
+            if not data or 'data' not in data:
+                # Don't cache a partial listing
+                return papers
+            papers.extend(data['data'])
+            offset = data.get('next')
+        self._cache_set(cache_key, papers)
+        return papers
+
+    def resolve_publications(self, publications: List[Dict[str, Any]], author_name: str) -> List[Optional[Dict[str, Any]]]:
+        """
+        Resolve a whole publication list in as few requests as possible: papers with a DOI
+        go through /paper/batch, then the remaining titles are matched locally against the
+        author's paper list. Entries that could not be resolved are left as None.
+        """
+        results = [None] * len(publications)
+
+        doi_indices = [i for i, pub in enumerate(publications) if normalize_doi(pub.get('doi'))]
+        if doi_indices:
+            ids = [f"DOI:{normalize_doi(publications[i]['doi'])}" for i in doi_indices]
+            for i, paper in zip(doi_indices, self.get_papers_batch(ids)):
+                if paper and paper.get('title'):
+                    results[i] = format_paper(paper)
+
+        unresolved = [i for i, result in enumerate(results) if result is None]
+        if not unresolved:
+            return results
+
+        author_id = self.find_author_id(author_name)
+        if author_id is None:
+            print(f"No Semantic Scholar author profile found for: {author_name}")
+            return results
+
+        author_papers = [p for p in self.get_author_papers(author_id) if p.get('title')]
+        by_title = {normalize_title(p['title']): p for p in author_papers}
+        for i in unresolved:
+            title = publications[i]['title']
+            paper = by_title.get(normalize_title(title))
+            if paper is None:
+                best = max(author_papers, key=lambda p: fuzz.ratio(p['title'].lower(), title.lower()), default=None)
+                if best is not None and fuzzy_match(best['title'], title):
+                    paper = best
+            if paper is not None:
+                results[i] = format_paper(paper)
+
+        return results
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> SemanticScholarClient:
+    """Return the process-wide client so every caller shares one pool and one rate limit."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            cache = SQLiteCache(S2_CACHE_PATH, ttl=S2_CACHE_TTL, max_entries=S2_CACHE_MAX_ENTRIES) if S2_CACHE_PATH else None
+            _client = SemanticScholarClient(cache=cache)
+        return _client
+
+def search_semantic_scholar(query, author_name, validate_authors=True):
+    return get_client().search_paper(query, author_name, validate_authors=validate_authors)
+
+def resolve_publications(publications, author_name):
+    return get_client().resolve_publications(publications, author_name)
+
+def cache_stats():
+    cache = get_client().cache
+    return cache.stats() if cache is not None else None
 
 def main():
     # Test examples
@@ -113,5 +344,9 @@ def main():
             print(f"No matching paper found for '{title_or_doi}' with author '{author}'")
         print("---")
 
+    stats = cache_stats()
+    if stats:
+        print(f"Cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
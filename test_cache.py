@@ -0,0 +1,32 @@
+import cache
+from cache import MISSING, SQLiteCache
+
+def test_size_bound_holds_across_short_runs(tmp_path):
+    # Each instance stands for one short process that writes far fewer than
+    # EVICT_INTERVAL entries
+    path = str(tmp_path / "cache.sqlite")
+    for run in range(10):
+        store = SQLiteCache(path, max_entries=5)
+        for i in range(10):
+            store.set(f"{run}-{i}", i)
+        assert store.stats()["entries"] <= 5
+    assert SQLiteCache(path, max_entries=5).stats()["entries"] == 5
+
+def test_eviction_keeps_recently_used_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "EVICT_INTERVAL", 1000)
+    store = SQLiteCache(str(tmp_path / "cache.sqlite"), max_entries=3)
+    for key in ("a", "b", "c"):
+        store.set(key, key)
+    assert store.get("a") == "a"
+    store.set("d", "d")
+    assert store.get("b") is MISSING
+    assert [store.get(key) for key in ("a", "c", "d")] == ["a", "c", "d"]
+
+def test_overwrites_do_not_count_as_new_entries(tmp_path):
+    store = SQLiteCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    store.set("a", 1)
+    store.set("b", 1)
+    for value in range(5):
+        store.set("a", value)
+    assert store.get("a") == 4
+    assert store.get("b") == 1
@@ -0,0 +1,117 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from openai import OpenAI
+
+import cache
+import llm_cache
+import openai_batch
+from llm_cache import BatchPending, create_chat_completion
+
+class StubBatchAPI(BaseHTTPRequestHandler):
+    """Minimal Files and Batches API: every batch completes as soon as it is created."""
+    files = {}
+    batches = {}
+    chat_requests = 0
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body, content_type="application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/v1/files":
+            # The multipart upload carries the JSONL input; pick out its request lines
+            lines = [line for line in body.decode("utf-8").splitlines() if line.startswith('{"custom_id"')]
+            file_id = f"file-{len(self.files)}"
+            self.files[file_id] = "\n".join(lines)
+            self.reply({"id": file_id, "object": "file", "bytes": len(body), "created_at": 0,
+                        "filename": "requests.jsonl", "purpose": "batch", "status": "processed"})
+        elif self.path == "/v1/batches":
+            request = json.loads(body)
+            batch_id = f"batch-{len(self.batches)}"
+            output = []
+            for line in self.files[request["input_file_id"]].splitlines():
+                item = json.loads(line)
+                completion = {
+                    "id": f"chatcmpl-{item['custom_id'][:8]}", "object": "chat.completion", "created": 0,
+                    "model": item["body"]["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": item["body"]["messages"][-1]["content"].upper()}}],
+                }
+                output.append(json.dumps({"id": f"req-{len(output)}", "custom_id": item["custom_id"],
+                                          "response": {"status_code": 200, "request_id": "req", "body": completion}, "error": None}))
+            output_id = f"file-{len(self.files)}"
+            self.files[output_id] = "\n".join(output)
+            self.batches[batch_id] = {
+                "id": batch_id, "object": "batch", "endpoint": request["endpoint"], "input_file_id": request["input_file_id"],
+                "completion_window": request["completion_window"], "status": "completed", "created_at": 0,
+                "output_file_id": output_id, "error_file_id": None,
+            }
+            self.reply(self.batches[batch_id])
+        else:
+            StubBatchAPI.chat_requests += 1
+            self.send_error(404)
+
+    def do_GET(self):
+        if self.path.startswith("/v1/batches/"):
+            self.reply(self.batches[self.path.rsplit("/", 1)[1]])
+        elif self.path.startswith("/v1/files/") and self.path.endswith("/content"):
+            self.reply(self.files[self.path.split("/")[3]].encode("utf-8"), "application/jsonl")
+        else:
+            self.send_error(404)
+
+@pytest.fixture
+def stub_client():
+    StubBatchAPI.files, StubBatchAPI.batches, StubBatchAPI.chat_requests = {}, {}, 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubBatchAPI)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield OpenAI(api_key="test", base_url=f"http://127.0.0.1:{server.server_port}/v1", max_retries=0)
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def offline_mode(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_BACKEND", "memory")
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_PATH", str(tmp_path / "llm.sqlite"))
+    monkeypatch.setattr(llm_cache, "_cache", None)
+    monkeypatch.setattr(llm_cache, "_evict", True)
+    monkeypatch.setattr(llm_cache, "rate_limiter", None)
+    monkeypatch.setattr(openai_batch, "BATCH_STATE_PATH", str(tmp_path / "batch.sqlite"))
+    monkeypatch.setattr(openai_batch, "_store", None)
+    # Small enough that an evicting cache would drop responses before the rerun
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_MAX_ENTRIES", 1)
+    monkeypatch.setattr(cache, "EVICT_INTERVAL", 1)
+    openai_batch.enable_offline_mode()
+    yield
+    openai_batch.disable_offline_mode()
+
+def test_offline_round_trip(stub_client, offline_mode):
+    requests = [{"model": "gpt-4o", "messages": [{"role": "user", "content": f"question {i}"}]} for i in range(3)]
+
+    # First run: every request is queued instead of sent
+    for request in requests:
+        with pytest.raises(BatchPending):
+            create_chat_completion(stub_client, **request)
+    assert openai_batch.get_store().stats() == {"queued": 3, "submitted": 0}
+
+    assert len(openai_batch.submit_pending(stub_client)) == 1
+    assert openai_batch.collect_results(stub_client) == {"open": 0, "completed": 3, "failed": 0}
+
+    # Rerun: every response comes from the cache and nothing new is queued or submitted
+    for i, request in enumerate(requests):
+        assert create_chat_completion(stub_client, **request).choices[0].message.content == f"QUESTION {i}"
+    assert openai_batch.get_store().stats() == {"queued": 0, "submitted": 0}
+    assert openai_batch.submit_pending(stub_client) == []
+    assert len(StubBatchAPI.batches) == 1
+    assert StubBatchAPI.chat_requests == 0
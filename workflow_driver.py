@@ -1,39 +1,242 @@
 import os
 import json
-from pdf_parser import extract_text_from_pdf, parse_cv, predict_research_field
-from cv_data_enrichment import enrich_cv_data
-from cv_analyst import analyze_cv, generate_insights
-from evaluator import O1AEvaluation, CategoryRating, evaluate_category
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from cache import MISSING, SQLiteCache, make_key
+from checkpoints import get_checkpoint_store
+from pdf_extraction import PDF_MAX_PAGES, iter_pdf_pages
+from pdf_parser import parse_pages_with_fields, PARSE_CHUNK_THRESHOLD_TOKENS, PARSE_CHUNK_TOKENS
+from cv_data_enrichment import enrich_cv_data, enrich_cv_data_incremental, iter_enriched_publications, search_media_coverage, MEDIA_OUTLETS, S2_ENRICHMENT_MODE
+from cv_analyst import analyze_cv, analyze_cv_incremental, generate_insights, label_publication_stream
+from publication_scoring import PUBLICATION_RULES, PUBLICATION_RULES_VERSION
+from incremental import INCREMENTAL_EVALUATION, load_snapshot, save_snapshot
+from evaluator import O1AEvaluation, CategoryRating, CATEGORIES, EVALUATION_MODE, EVALUATION_PROMPT_VERSION, category_inputs, evaluate_categories
 
-def process_cv(pdf_path: str) -> dict:
+# Whole-evaluation cache keyed by the PDF bytes and the pipeline configuration; set
+# RESULT_CACHE_PATH to an empty string to disable it
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", os.path.join(".cache", "results.sqlite"))
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", 30 * 24 * 3600))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", 1000))
+# Bump when prompts or output structure change so stale evaluations are not served
+PIPELINE_VERSION = 1
+
+# Label publications in batches as their enrichment finishes instead of after all lookups
+PUBLICATION_PIPELINE = os.environ.get("PUBLICATION_PIPELINE", "1") == "1"
+
+# Per-stage checkpoint versions; bumping one reruns that stage and everything downstream of
+# it on the next evaluation of a CV, while earlier stages resume from their checkpoints
+STAGE_VERSIONS = {
+    "parse": 2,
+    "enrich": 1,
+    "analyze": 1,
+    "insights": 1,
+    "evaluate": EVALUATION_PROMPT_VERSION,
+}
+
+# Publication labels also depend on the rule tables of publication_scoring, if enabled
+LABEL_RULES_VERSION = PUBLICATION_RULES_VERSION if PUBLICATION_RULES else None
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache() -> Optional[SQLiteCache]:
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None and RESULT_CACHE_PATH:
+            _result_cache = SQLiteCache(RESULT_CACHE_PATH, ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES)
+        return _result_cache
+
+def pipeline_config() -> Dict[str, Any]:
+    """Settings that change the evaluation of an otherwise identical PDF."""
+    return {
+        "version": PIPELINE_VERSION,
+        "stage_versions": STAGE_VERSIONS,
+        "label_rules_version": LABEL_RULES_VERSION,
+        "categories": CATEGORIES,
+        "evaluation_mode": EVALUATION_MODE,
+        "pdf_max_pages": PDF_MAX_PAGES,
+        "parse_chunk_threshold_tokens": PARSE_CHUNK_THRESHOLD_TOKENS,
+        "parse_chunk_tokens": PARSE_CHUNK_TOKENS,
+        "s2_enrichment_mode": S2_ENRICHMENT_MODE,
+        "media_outlets": MEDIA_OUTLETS,
+    }
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def result_cache_key(pdf_path: str) -> str:
+    return make_key("process_cv", file_digest(pdf_path), pipeline_config())
+
+def invalidate_cached_result(key: Optional[str] = None, pdf_path: Optional[str] = None):
+    """Drop one cached evaluation (by key or by PDF), or every cached evaluation if neither is given."""
+    cache = get_result_cache()
+    if cache is None:
+        return
+    if key is None and pdf_path is None:
+        cache.clear()
+    else:
+        cache.delete(key or result_cache_key(pdf_path))
+
+def process_cv(pdf_path: str, on_event: Optional[Callable[[str, Any], None]] = None, use_cache: bool = True,
+               cache_info: Optional[Dict[str, Any]] = None, incremental: Optional[bool] = None) -> dict:
+    # on_event(name, data) is called as each stage finishes, so callers can report
+    # partial results long before the full evaluation is ready.
+    # cache_info, if given, receives the result cache key and "hit" or "miss".
+    # incremental reuses enrichment and labels from the applicant's previous CV for
+    # records that did not change (defaults to INCREMENTAL_EVALUATION).
+    cache = get_result_cache() if use_cache else None
+    key = result_cache_key(pdf_path) if cache is not None else None
+    if cache_info is not None:
+        cache_info.update({"key": key, "status": "miss" if cache is not None else "bypass"})
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not MISSING:
+            if cache_info is not None:
+                cache_info["status"] = "hit"
+            return cached
+    
+    output = run_stages(pdf_path, on_event, INCREMENTAL_EVALUATION if incremental is None else incremental)
+    if cache is not None:
+        cache.set(key, output)
+    return output
+
+def snapshot_settings(cv_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Settings behind each stage of an applicant snapshot (see incremental.load_snapshot)."""
+    return {
+        "enrich": {"version": STAGE_VERSIONS["enrich"], "mode": S2_ENRICHMENT_MODE, "media_outlets": MEDIA_OUTLETS},
+        "analyze": {
+            "version": STAGE_VERSIONS["analyze"],
+            "label_rules_version": LABEL_RULES_VERSION,
+            "research_fields": cv_data.get("predicted_research_fields"),
+        },
+    }
+
+def enrich_and_label_publications(cv_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Enrich publications and label them as one pipelined stage: enriched publications are
+    handed to the labeller as their lookups finish and labelled in size-bounded batches,
+    while the media coverage search runs alongside.
+    """
+    publications = cv_data["publications"]
+    enriched_publications = [None] * len(publications)
+    
+    def enriched_stream():
+        for i, enriched_pub in iter_enriched_publications(publications, cv_data["name"]):
+            enriched_publications[i] = enriched_pub
+            yield i, enriched_pub
+    
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        media_future = executor.submit(search_media_coverage, cv_data["name"])
+        labelled_publications = label_publication_stream(
+            enriched_stream(), len(publications), fields=cv_data.get("predicted_research_fields")
+        )
+        media_coverage = media_future.result()
+    
+    enriched_cv_data = {**cv_data, "publications": enriched_publications, "media_coverage": media_coverage}
+    return {"enriched_cv_data": enriched_cv_data, "labelled_publications": labelled_publications}
+
+def parse_stage(pdf_path: str) -> Dict[str, Any]:
+    # One request returns both the structured CV and its research fields; long CVs start
+    # chunk extraction on the first pages while later pages are still being decoded
+    parsed_cv, research_fields = parse_pages_with_fields(iter_pdf_pages(pdf_path))
+    return {"parsed_cv": parsed_cv, "research_fields": research_fields["fields"]}
+
+def run_stages(pdf_path: str, on_event: Optional[Callable[[str, Any], None]] = None, incremental: bool = False) -> dict:
+    # Every stage is checkpointed under a hash of its inputs, so a retry after a failure
+    # resumes from the last completed stage instead of starting over
+    emit = on_event or (lambda name, data: None)
+    checkpoints = get_checkpoint_store()
+    
     # Step 1: Parse PDF
-    cv_text = extract_text_from_pdf(pdf_path)
-    parsed_cv = parse_cv(cv_text)
-    research_fields = predict_research_field(cv_text)
+    parse_inputs = {
+        "pdf": file_digest(pdf_path),
+        "pdf_max_pages": PDF_MAX_PAGES,
+        "parse_chunk_threshold_tokens": PARSE_CHUNK_THRESHOLD_TOKENS,
+        "parse_chunk_tokens": PARSE_CHUNK_TOKENS,
+    }
+    parsed = checkpoints.run("parse", STAGE_VERSIONS["parse"], parse_inputs, lambda: parse_stage(pdf_path))
+    parsed_cv = parsed["parsed_cv"]
+    emit("parsed_cv", parsed_cv)
+    emit("research_fields", parsed["research_fields"])
     
     # Combine parsed CV and research fields
-    cv_data = {**parsed_cv, "predicted_research_fields": research_fields["fields"]}
+    cv_data = {**parsed_cv, "predicted_research_fields": parsed["research_fields"]}
+    
+    # In incremental mode, records unchanged since the applicant's previous CV keep their
+    # enrichment and labels, and only new or edited records are sent out again. The
+    # snapshot is saved at the end of every run; `incremental` only decides whether to load it.
+    settings = snapshot_settings(cv_data)
+    previous = load_snapshot(cv_data, settings) if incremental else None
     
     # Step 2: Enrich CV data using Semantic Scholar API
-    enriched_cv_data = enrich_cv_data(cv_data)
+    enrich_inputs = {"cv_data": cv_data, "mode": S2_ENRICHMENT_MODE, "media_outlets": MEDIA_OUTLETS}
+    labelled = {}
+    if incremental or not PUBLICATION_PIPELINE:
+        enriched_cv_data = checkpoints.run(
+            "enrich", STAGE_VERSIONS["enrich"], enrich_inputs,
+            lambda: enrich_cv_data_incremental(cv_data, previous) if incremental else enrich_cv_data(cv_data)
+        )
+    else:
+        # Publications are labelled in batches while later lookups are still running
+        pipelined = checkpoints.run(
+            "enrich_label", (STAGE_VERSIONS["enrich"], STAGE_VERSIONS["analyze"], LABEL_RULES_VERSION), enrich_inputs, lambda: enrich_and_label_publications(cv_data)
+        )
+        enriched_cv_data = pipelined["enriched_cv_data"]
+        labelled["publications"] = pipelined["labelled_publications"]
+    emit("enriched_publications", enriched_cv_data["publications"])
     
     # Step 3: Analyze CV
-    further_enriched_cv = analyze_cv(enriched_cv_data)
-    insights = generate_insights(further_enriched_cv)
+    further_enriched_cv = checkpoints.run(
+        "analyze", (STAGE_VERSIONS["analyze"], LABEL_RULES_VERSION), enriched_cv_data,
+        lambda: analyze_cv_incremental(enriched_cv_data, previous) if incremental else analyze_cv(enriched_cv_data, labelled=labelled)
+    )
+    emit("labelled_sections", {
+        section: further_enriched_cv[section]
+        for section in ("education", "awards", "publications", "employment_history", "media_coverage")
+    })
     
-    # Step 4: Evaluate O1A visa categories
-    categories = [
-        "Awards", "Membership", "Press", "Judging", "Original contribution",
-        "Scholarly articles", "Critical employment", "High remuneration"
-    ]
+    # Step 4: Evaluate O1A visa categories (concurrently, results in category order).
+    # Insights only need the analysed CV, so they are generated alongside the evaluations.
+    # Each category is checkpointed on its own inputs, so a retry only redoes the ones that
+    # failed and a revised CV only re-evaluates the categories whose data changed.
+    analysed_key = make_key(further_enriched_cv)
+    category_keys = {
+        category: checkpoints.key("evaluate", STAGE_VERSIONS["evaluate"], {"category": category, "mode": EVALUATION_MODE, **category_inputs(category, further_enriched_cv)})
+        for category in CATEGORIES
+    }
+    done = {category: checkpoints.get(key) for category, key in category_keys.items()}
+    done = {category: evaluation for category, evaluation in done.items() if evaluation is not MISSING}
+    for category, evaluation in done.items():
+        emit("category_rating", {"category": category, **evaluation})
+    
+    def on_evaluation(category, evaluation):
+        checkpoints.set(category_keys[category], evaluation)
+        emit("category_rating", {"category": category, **evaluation})
+    
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        insights_future = executor.submit(
+            checkpoints.run, "insights", STAGE_VERSIONS["insights"], analysed_key,
+            lambda: generate_insights(further_enriched_cv)
+        )
+        remaining = [category for category in CATEGORIES if category not in done]
+        if remaining:
+            done.update(zip(remaining, evaluate_categories(remaining, further_enriched_cv, on_result=on_evaluation)))
+        evaluations = [done[category] for category in CATEGORIES]
+        insights = insights_future.result()
+    emit("insights", insights)
     
     category_ratings = []
     qualifying_achievements = []
     overall_rating = "low"
     rating_counts = {"low": 0, "medium": 0, "high": 0}
     
-    for category in categories:
-        evaluation = evaluate_category(category, further_enriched_cv)
+    for category, evaluation in zip(CATEGORIES, evaluations):
         category_rating = CategoryRating(
             category=category,
             rating=evaluation["rating"],
@@ -71,7 +274,11 @@ def process_cv(pdf_path: str) -> dict:
         "overall_rating": overall_rating,
         "insights": insights
     }
+    output["markdown_summary"] = generate_markdown_summary(output)
     
+    # Saved on every successful run, incremental or not, so the applicant's next CV can
+    # be evaluated incrementally against this one
+    save_snapshot(cv_data, enriched_cv_data, further_enriched_cv, settings)
     return output
 
 def generate_markdown_summary(output: dict) -> str:
@@ -103,7 +310,6 @@ if __name__ == "__main__":
     result = process_cv(pdf_path)
     print(json.dumps(result, indent=2))
     
-    summary = generate_markdown_summary(result)
     with open("summary.md", "w") as f:
-        f.write(summary)
+        f.write(result["markdown_summary"])
     print("Processing complete. Check the output files for results.")
\ No newline at end of file